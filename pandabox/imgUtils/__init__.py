@@ -1,3 +1,6 @@
 from .imgutils import imgUtils
+from .writer import ImageWriter
+from .tiff import TiledImage
+from .manifest import Manifest
 
 
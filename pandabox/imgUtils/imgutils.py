@@ -1,17 +1,106 @@
 import os
 import sys
 import re
+import io
 import glob
+import struct
 import errno
 import shutil
 import random
+import inspect
+import hashlib
+import tarfile
+import tempfile
+import contextlib
+import warnings
+import collections
+import xml.etree.ElementTree as ET
 import numpy as np
 import cv2
 import skimage
 import skimage.io
 import skimage.transform
 import skimage.filters
+import skimage.util
 import joblib
+from joblib.externals.loky import get_reusable_executor
+from .writer import ImageWriter
+from .tiff import TiledImage
+from .manifest import Manifest, _image_size, _IMAGE_EXTENSIONS
+
+
+
+# keyword argument of the seed of `random_noise`, renamed in scikit-image 0.21
+_RANDOM_NOISE_SEED = 'rng' if 'rng' in inspect.signature(skimage.util.random_noise).parameters else 'seed'
+
+
+
+def _reflink(src, dst):
+    # copy a file with reflink (copy-on-write clone) if the filesystem supports it
+    try:
+        import fcntl
+        with open(src, 'rb') as infh, open(dst, 'wb') as outfh:
+            fcntl.ioctl(outfh.fileno(), 0x40049409, infh.fileno())  # FICLONE
+    except (ImportError, OSError):
+        shutil.copy(src, dst)
+
+
+
+def _open_writer(writer):
+    # the writer given by the caller is kept open, and a new writer is closed at the end
+    return contextlib.nullcontext(writer) if writer is not None else ImageWriter()
+
+
+
+def _parse_PascalVOC_files(file_paths):
+    # parse Pascal VOC XML files with a streaming XML parser, and return
+    # image file names, image shapes, and objects of the XML files
+    image_files = []
+    shapes = []
+    objects = []
+    
+    for file_path in file_paths:
+        image_file = ''
+        shape = {'width': -1, 'height': -1, 'depth': -1}
+        _objects = []
+        obj = None
+        
+        # tags from the root to the current element, only the direct children of
+        # `object` and its `bndbox` are read, the others (e.g. `part`) are ignored
+        path = []
+        for event, elem in ET.iterparse(file_path, events=('start', 'end')):
+            if event == 'start':
+                path.append(elem.tag)
+                if path[1:] == ['object']:
+                    obj = {'name': '', 'xmin': -1, 'ymin': -1, 'xmax': -1, 'ymax': -1}
+                continue
+            
+            parent = path[1:-1]
+            if path[1:] == ['object']:
+                _objects.append([obj['name'], obj['xmin'], obj['ymin'], obj['xmax'], obj['ymax']])
+                obj = None
+                elem.clear()
+            elif parent == ['object'] and elem.tag == 'name':
+                obj['name'] = (elem.text or '').strip()
+            elif parent == ['object', 'bndbox'] and elem.tag in ['xmin', 'ymin', 'xmax', 'ymax']:
+                obj[elem.tag] = int(float(elem.text))
+            elif parent == ['size'] and elem.tag in shape:
+                shape[elem.tag] = int(elem.text)
+            elif parent == [] and elem.tag == 'filename':
+                image_file = (elem.text or '').strip()
+            path.pop()
+        
+        image_files.append(image_file)
+        shapes.append([shape['width'], shape['height'], shape['depth']])
+        objects.append(_objects)
+    
+    return image_files, shapes, objects
+
+
+
+_CROP_INDEX_DTYPE = np.dtype([('offset', np.int64), ('height', np.int32), ('width', np.int32),
+                              ('channels', np.int32), ('dtype', 'S4'), ('image_index', np.int32), ('class_code', np.int32),
+                              ('xmin', np.int32), ('ymin', np.int32), ('xmax', np.int32), ('ymax', np.int32)])
 
 
 
@@ -19,14 +108,29 @@ class imgUtils:
     
     
     
-    def __init__(self):
+    def __init__(self, backend='skimage', dtype=np.uint8):
+        '''
+        Args:
+            backend (str): A library for augmentation, `skimage` or `opencv`.
+                           `skimage` converts images to float64 in each step,
+                           and `opencv` keeps images in `dtype`.
+            dtype (numpy.dtype): `numpy.uint8` or `numpy.float32` (values in [0, 1]),
+                                 the type of images augmented with `opencv` backend.
+        '''
+        
+        if backend not in ['skimage', 'opencv']:
+            raise ValueError('Only `skimage` or `opencv` can be set in `backend` argument.')
+        if np.dtype(dtype) not in [np.uint8, np.float32]:
+            raise ValueError('Only `numpy.uint8` or `numpy.float32` can be set in `dtype` argument.')
+        self.backend = backend
+        self.dtype = np.dtype(dtype)
         
-        self.image_extension = ['.jpeg', '.jpg', '.png', '.tif', '.tiff',
-                                '.JPEG', '.JPG', '.PNG', '.TIF', '.TIFF']
+        self.image_extension = _IMAGE_EXTENSIONS + [ext.upper() for ext in _IMAGE_EXTENSIONS]
     
     
     
-    def train_test_split(self, data_dirpath=None, output_dirpath=None, test_size=0.20):
+    def train_test_split(self, data_dirpath=None, output_dirpath=None, test_size=0.20, mode='copy',
+                         random_state=None, n_jobs=1):
         '''Split datasets into two subsets for training and test.
         
         The original directory should contains several sub-directories.
@@ -61,42 +165,86 @@ class imgUtils:
         ```
         
         
+        Images of each class are shuffled and exactly `test_size` of them
+        (rounded) are assigned to test subset. Instead of copying images,
+        `mode` can be set to `hardlink`, `symlink`, `reflink` (copy-on-write
+        clone, falls back to copy if the filesystem does not support it), or
+        `manifest` which only writes `train.txt` and `test.txt` into the output
+        directory, each line contains an image path and its class label.
+        
         Args:
-            data_dirpath (str): A path to a directory which contains whole datasets.
+            data_dirpath (str, Manifest): A path to a directory which contains whole datasets,
+                                          or the manifest of the directory.
             output_dirpath (str): A path to a directory to store the split subsets.
             test_size (float): the ratio to split.
+            mode (str): `copy`, `hardlink`, `symlink`, `reflink`, or `manifest`.
+            random_state (int): A seed for shuffling images.
+            n_jobs (int): The number of threads to copy or link images.
         '''
         
         
             
-        if not os.path.exists(data_dirpath):
+        if not isinstance(data_dirpath, Manifest) and not os.path.exists(data_dirpath):
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), data_dirpath)
         
-        train_output_dirpath = os.path.join(output_dirpath, 'train')
-        test_output_dirpath = os.path.join(output_dirpath, 'test')
+        if mode not in ['copy', 'hardlink', 'symlink', 'reflink', 'manifest']:
+            raise ValueError('Only `copy`, `hardlink`, `symlink`, `reflink`, or `manifest` can be set in `mode` argument.')
+        
+        image_extension = set(self.image_extension)
+        random_state = np.random.RandomState(random_state)
         
-        if not os.path.exists(train_output_dirpath):
-            os.mkdir(train_output_dirpath)
+        # split images of each class
+        subsets = {'train': [], 'test': []}
+        if isinstance(data_dirpath, Manifest):
+            class_labels = data_dirpath.classes
+        else:
+            class_labels = sorted([d.name for d in os.scandir(data_dirpath) if d.is_dir()])
+        for class_label in class_labels:
+            if isinstance(data_dirpath, Manifest):
+                # images directly under the class directory
+                image_files = sorted([f for f in data_dirpath.file_paths(class_label, image_extension)
+                                      if os.path.dirname(f) == os.path.join(data_dirpath.root, class_label)])
+            else:
+                image_files = sorted([f.path for f in os.scandir(os.path.join(data_dirpath, class_label))
+                                      if os.path.splitext(f.name)[1] in image_extension and f.is_file()])
             
-        if not os.path.exists(test_output_dirpath):
-            os.mkdir(test_output_dirpath)
+            is_test = np.zeros(len(image_files), dtype=bool)
+            is_test[random_state.permutation(len(image_files))[:int(round(len(image_files) * test_size))]] = True
+            for image_file, _is_test in zip(image_files, is_test):
+                subsets['test' if _is_test else 'train'].append([image_file, class_label])
         
-        for class_label in os.listdir(data_dirpath):
-            _train_output_dirpath = os.path.join(train_output_dirpath, class_label)
-            _test_output_dirpath = os.path.join(test_output_dirpath, class_label)
+        if not os.path.exists(output_dirpath):
+            os.makedirs(output_dirpath)
         
-            if not os.path.exists(_train_output_dirpath):
-                os.mkdir(_train_output_dirpath)
-            
-            if not os.path.exists(_test_output_dirpath):
-                os.mkdir(_test_output_dirpath)
-            
-            for ext in self.image_extension:
-                for _f in glob.glob(os.path.join(data_dirpath, class_label, '*' + ext)):
-                    if random.random() > test_size:
-                        shutil.copy(_f, os.path.join(_train_output_dirpath, os.path.basename(_f)))
-                    else:
-                        shutil.copy(_f, os.path.join(_test_output_dirpath, os.path.basename(_f)))
+        if mode == 'manifest':
+            for subset, image_files in subsets.items():
+                with open(os.path.join(output_dirpath, subset + '.txt'), 'w') as outfh:
+                    for image_file, class_label in image_files:
+                        outfh.write(image_file + '\t' + class_label + '\n')
+            return
+        
+        # create directories once, then copy or link images in parallel
+        for subset in subsets.keys():
+            for class_label in class_labels:
+                _output_dirpath = os.path.join(output_dirpath, subset, class_label)
+                if not os.path.exists(_output_dirpath):
+                    os.makedirs(_output_dirpath)
+        
+        def __transfer(image_file, new_file_path):
+            if os.path.lexists(new_file_path):
+                os.remove(new_file_path)
+            if mode == 'hardlink':
+                os.link(image_file, new_file_path)
+            elif mode == 'symlink':
+                os.symlink(os.path.abspath(image_file), new_file_path)
+            elif mode == 'reflink':
+                _reflink(image_file, new_file_path)
+            else:
+                shutil.copy(image_file, new_file_path)
+        
+        joblib.Parallel(n_jobs=n_jobs, prefer='threads', verbose=0)(
+                [joblib.delayed(__transfer)(image_file, os.path.join(output_dirpath, subset, class_label, os.path.basename(image_file)))
+                 for subset, image_files in subsets.items() for image_file, class_label in image_files])
         
     
     
@@ -170,103 +318,475 @@ class imgUtils:
     
     
     
-    def crop_images(self, file_path, objects, output_dirpath=None):
+    def load_PascalVOC(self, input_dirpath, cache_path=None, n_jobs=-1, chunk_size=1000):
+        '''Load all Pascal VOC annotations in a directory.
+        
+        XML files are parsed with a streaming XML parser in parallel processes,
+        and annotations are returned as columnar arrays. If `cache_path` is given,
+        the arrays are saved into the file (NumPy .npz), and loaded from it at the
+        next time unless the names, sizes, or modification times of the XML files
+        are changed.
+        
+        Args:
+            input_dirpath (str): A path to a directory which contains XML files.
+            cache_path (str): A path to the cache file.
+            n_jobs (int): The number of processes.
+            chunk_size (int): The number of XML files parsed in a task.
+        
+        Returns:
+            dict: A dictionary contains `xml_files` (paths to XML files), `image_files`
+                  (`filename` in XML files), `shape` (width, height, and depth of images),
+                  `classes` (class labels), and arrays of objects, `image_index`
+                  (index of images), `class_code` (index of `classes`), and `xmin`,
+                  `ymin`, `xmax`, and `ymax` (int32).
+        '''
+        
+        xml_files = []
+        fingerprint = hashlib.sha1()
+        for f in sorted(os.scandir(input_dirpath), key=lambda x: x.name):
+            if f.name.endswith('.xml') and f.is_file():
+                xml_files.append(f.path)
+                f_stat = f.stat()
+                fingerprint.update((f.name + '\t' + str(f_stat.st_size) + '\t' + str(f_stat.st_mtime_ns) + '\n').encode())
+        fingerprint = fingerprint.hexdigest()
+        
+        fields = ['xml_files', 'image_files', 'shape', 'classes',
+                  'image_index', 'class_code', 'xmin', 'ymin', 'xmax', 'ymax']
+        
+        if cache_path is not None and os.path.exists(cache_path):
+            with np.load(cache_path) as cache:
+                if str(cache['fingerprint']) == fingerprint:
+                    annotations = {k: cache[k] for k in fields}
+                    annotations['xml_files'] = annotations['xml_files'].tolist()
+                    annotations['image_files'] = annotations['image_files'].tolist()
+                    annotations['classes'] = annotations['classes'].tolist()
+                    return annotations
+        
+        parsed_chunks = joblib.Parallel(n_jobs=n_jobs, verbose=0)(
+                [joblib.delayed(_parse_PascalVOC_files)(xml_files[i:(i + chunk_size)])
+                 for i in range(0, len(xml_files), chunk_size)])
+        
+        image_files = []
+        shapes = []
+        objects = []
+        for _image_files, _shapes, _objects in parsed_chunks:
+            image_files.extend(_image_files)
+            shapes.extend(_shapes)
+            objects.extend(_objects)
+        
+        classes = sorted(set([obj[0] for _objects in objects for obj in _objects]))
+        class_codes = {c: i for i, c in enumerate(classes)}
+        n_objects = [len(_objects) for _objects in objects]
+        objects = [obj for _objects in objects for obj in _objects]
+        
+        annotations = {
+            'xml_files': xml_files,
+            'image_files': image_files,
+            'shape': np.array(shapes, dtype=np.int32).reshape(-1, 3),
+            'classes': classes,
+            'image_index': np.repeat(np.arange(len(n_objects), dtype=np.int32), n_objects),
+            'class_code': np.array([class_codes[obj[0]] for obj in objects], dtype=np.int32)
+        }
+        for i, k in enumerate(['xmin', 'ymin', 'xmax', 'ymax']):
+            annotations[k] = np.array([obj[i + 1] for obj in objects], dtype=np.int32)
+        
+        if cache_path is not None:
+            _annotations = dict(annotations)
+            for k in ['xml_files', 'image_files', 'classes']:
+                _annotations[k] = np.array(annotations[k], dtype=str)
+            with open(cache_path, 'wb') as outfh:
+                np.savez(outfh, fingerprint=np.array(fingerprint), **_annotations)
+        
+        return annotations
+    
+    
+    
+    
+    
+    def __open_image(self, file_path, flags, tile_cache_size):
+        # large TIFF images are read by tiles (RGB), and the others are decoded by OpenCV (BGR)
+        if os.path.splitext(file_path)[1].lower() in ['.tif', '.tiff']:
+            try:
+                return TiledImage(file_path, cache_size=tile_cache_size), 'RGB'
+            except ImportError:
+                pass
+        return cv2.imread(file_path, flags), 'BGR'
+    
+    
     
-        img = cv2.imread(file_path, cv2.IMREAD_UNCHANGED)
+    def crop_images(self, file_path, objects, output_dirpath=None, writer=None, n_jobs=1, tile_cache_size=64):
+        '''Crop objects from an image.
+        
+        TIFF images are read with `TiledImage`, which reads only the tiles
+        touched by the objects. The objects are grouped by the tiles of their
+        upper left corners, and the groups are cropped in parallel threads
+        sharing the tile cache.
+        
+        Args:
+            file_path (str): A path to an image.
+            objects (list): Objects, a list of [class_label, xmin, ymin, xmax, ymax].
+            output_dirpath (str): A path to a directory to save cropped images.
+            writer (ImageWriter): A writer which decides the image format, PNG by default.
+            n_jobs (int): The number of threads.
+            tile_cache_size (int): The number of tiles kept in the cache.
+        '''
     
         if output_dirpath is None:
             raise ValueError('crop_images` function requires `output_dir` to save cropped images.')
     
-        if not os.path.exists(output_dirpath):
-            os.mkdir(output_dirpath)
+        img, channel_order = self.__open_image(file_path, cv2.IMREAD_UNCHANGED, tile_cache_size)
     
-        for obj in objects:
-            class_label = obj[0]
-        
-            _output_dirpath = os.path.join(output_dirpath, class_label)
-            if not os.path.exists(_output_dirpath):
-                os.mkdir(_output_dirpath)
+        with _open_writer(writer) as writer:
+            writer.makedirs([output_dirpath] + [os.path.join(output_dirpath, obj[0]) for obj in objects])
             
-            _xmin = obj[1]
-            _xmax = obj[3]
-            _ymin = obj[2]
-            _ymax = obj[4]
-            img_cropped = img[_ymin:_ymax, _xmin:_xmax]
+            # group objects by tiles
+            tiles = {}
+            for obj in objects:
+                tile_index = img.tile_index(max(obj[2], 0), max(obj[1], 0)) if isinstance(img, TiledImage) else (0, 0)
+                if tile_index not in tiles:
+                    tiles[tile_index] = []
+                tiles[tile_index].append(obj)
             
-            cv2.imwrite(os.path.join(_output_dirpath, '_'.join(map(str, obj))) + '.png', img_cropped)
+            def __crop_images(object_list):
+                for obj in object_list:
+                    class_label = obj[0]
+                
+                    _output_dirpath = os.path.join(output_dirpath, class_label)
+                    
+                    _xmin = obj[1]
+                    _xmax = obj[3]
+                    _ymin = obj[2]
+                    _ymax = obj[4]
+                    img_cropped = img[_ymin:_ymax, _xmin:_xmax]
+                    
+                    writer.write(os.path.join(_output_dirpath, '_'.join(map(str, obj))) + '.png', img_cropped, channel_order=channel_order)
+            
+            r = joblib.Parallel(n_jobs=n_jobs, prefer='threads', verbose=0)(
+                    [joblib.delayed(__crop_images)(tiles[k]) for k in sorted(tiles)])
+            
+            writer.flush()
         
         
 
 
-    def crop_blocks(self, file_path, objects, output_dirpath=None, block_size=3, n_blocks=1000):
+    def crop_dataset(self, input_dirpath, output_dirpath=None, output_format='npy', annotations=None,
+                     images_per_shard=1000, n_jobs=-1, writer=None):
+        '''Crop objects of all images in a directory into shard files.
+        
+        Images are processed in parallel processes, and each image is decoded
+        once for all its objects. The cropped images are packed into shards
+        (`shard_00000.npy`, ...), each of which contains the crops of
+        `images_per_shard` images.
+        
+        * `npy`: a flat byte array of all crops (`shard_00000.npy`) and an index
+          (`shard_00000.index.npy`), which is a structured array of byte offsets,
+          shapes, dtypes, image indexes, class codes, and bounding boxes of the
+          crops. Crops keep the dtype of the source images (e.g. uint16), and
+          can be read with `read_crop_shard`.
+        * `tar`: a tar file (`shard_00000.tar`) of PNG images, named as
+          `class_label/image_xmin_ymin_xmax_ymax.png`.
+        * `png`: PNG images saved into the sub-directories of class labels,
+          the same as `crop_images`.
+        
+        Args:
+            input_dirpath (str): A path to a directory which contains images and Pascal VOC XML files.
+            output_dirpath (str): A path to a directory to save shards.
+            output_format (str): `npy`, `tar`, or `png`.
+            annotations (dict): Output of `load_PascalVOC`, loaded from `input_dirpath` if not given.
+            images_per_shard (int): The number of images in a shard.
+            n_jobs (int): The number of processes.
+            writer (ImageWriter): A writer of `png` format, which decides the image format.
+        
+        Returns:
+            list: Paths to the shard files (or output directory for `png`).
+        '''
+        
+        if output_dirpath is None:
+            raise ValueError('crop_dataset` function requires `output_dirpath` to save cropped images.')
+        if output_format not in ['npy', 'tar', 'png']:
+            raise ValueError('Only `npy`, `tar`, or `png` can be set in `output_format` argument.')
+        if not os.path.exists(output_dirpath):
+            os.makedirs(output_dirpath)
+        
+        if annotations is None:
+            annotations = self.load_PascalVOC(input_dirpath, n_jobs=n_jobs)
+        
+        # image path of each XML file
+        image_files = []
+        for xml_file, image_file in zip(annotations['xml_files'], annotations['image_files']):
+            image_path = os.path.join(input_dirpath, image_file)
+            if image_file == '' or not os.path.exists(image_path):
+                for ext in self.image_extension:
+                    if os.path.exists(os.path.splitext(xml_file)[0] + ext):
+                        image_path = os.path.splitext(xml_file)[0] + ext
+                        break
+            image_files.append(image_path)
+        
+        # objects (class code and bounding box) of each image
+        n_images = len(image_files)
+        image_index = np.asarray(annotations['image_index'])
+        o = np.argsort(image_index, kind='stable')
+        object_bounds = np.searchsorted(image_index[o], np.arange(n_images + 1))
+        image_objects = np.stack([np.asarray(annotations[k])[o] for k in ['class_code', 'xmin', 'ymin', 'xmax', 'ymax']],
+                                 axis=1).astype(np.int64).reshape(-1, 5)
+        
+        classes = annotations['classes']
+        with _open_writer(writer) as writer:
+            if output_format == 'png':
+                writer.makedirs([os.path.join(output_dirpath, class_label) for class_label in classes])
+            
+            def __crop_shard(shard_id, shard_images):
+                # shard_images: image indexes, paths, and objects of the images in the shard
+                shard_path = os.path.join(output_dirpath, 'shard_{:05d}.{}'.format(shard_id, output_format))
+                crops = []
+                index = []
+                tarfh = tarfile.open(shard_path, 'w') if output_format == 'tar' else None
+                offset = 0
+                
+                for i, image_file, objects in shard_images:
+                    img = cv2.imread(image_file, cv2.IMREAD_UNCHANGED)
+                    if img is None:
+                        continue
+                    if img.ndim == 2:
+                        img = img[:, :, np.newaxis]
+                    image_name = os.path.splitext(os.path.basename(image_file))[0]
+                    
+                    for class_code, *bbox in objects.tolist():
+                        img_cropped = img[max(bbox[1], 0):max(bbox[3], 0), max(bbox[0], 0):max(bbox[2], 0)]
+                        crop_name = '_'.join([image_name] + list(map(str, bbox))) + '.png'
+                        
+                        if output_format == 'npy':
+                            # raw bytes of the crop, the dtype is recorded in the index
+                            crops.append(np.ascontiguousarray(img_cropped).view(np.uint8).reshape(-1))
+                            index.append((offset, img_cropped.shape[0], img_cropped.shape[1], img_cropped.shape[2],
+                                          img_cropped.dtype.str[1:], i, class_code, bbox[0], bbox[1], bbox[2], bbox[3]))
+                            offset += crops[-1].size
+                        elif output_format == 'tar':
+                            buff = cv2.imencode('.png', img_cropped)[1].tobytes()
+                            tarinfo = tarfile.TarInfo(name=classes[class_code] + '/' + crop_name)
+                            tarinfo.size = len(buff)
+                            tarfh.addfile(tarinfo, io.BytesIO(buff))
+                        else:
+                            writer.write(os.path.join(output_dirpath, classes[class_code], crop_name), img_cropped, channel_order='BGR')
+                
+                if output_format == 'npy':
+                    np.save(shard_path, np.concatenate(crops) if len(crops) > 0 else np.zeros(0, dtype=np.uint8))
+                    np.save(os.path.splitext(shard_path)[0] + '.index.npy', np.array(index, dtype=_CROP_INDEX_DTYPE))
+                elif output_format == 'tar':
+                    tarfh.close()
+                else:
+                    writer.flush()
+                    shard_path = output_dirpath
+                
+                return shard_path
+            
+            def __shard_images(image_from, image_to):
+                return [(i, image_files[i], image_objects[object_bounds[i]:object_bounds[i + 1]])
+                        for i in range(image_from, image_to) if object_bounds[i] < object_bounds[i + 1]]
+            
+            shard_paths = joblib.Parallel(n_jobs=n_jobs, verbose=0)(
+                    [joblib.delayed(__crop_shard)(k, __shard_images(image_from, min(image_from + images_per_shard, n_images)))
+                     for k, image_from in enumerate(range(0, n_images, images_per_shard))])
+            
+            if output_format == 'png':
+                return [output_dirpath]
+            return shard_paths
+    
     
-        img = cv2.imread(file_path)
+    
+    def read_crop_shard(self, shard_path, mmap=True):
+        '''Read cropped images from a shard of `crop_dataset` (`npy` format).
+        
+        Args:
+            shard_path (str): A path to a shard file (`shard_00000.npy`).
+            mmap (bool): If `True`, the shard is memory-mapped.
+        
+        Returns:
+            tuple: A list of cropped images (height x width x channels, in the
+                   dtype of the source images) and the index of the shard.
+        '''
+        
+        crops = np.load(shard_path, mmap_mode='r' if mmap else None)
+        index = np.load(os.path.splitext(shard_path)[0] + '.index.npy')
+        
+        images = []
+        for r in index:
+            # shards without dtypes are uint8
+            dtype = np.dtype(r['dtype'].decode()) if 'dtype' in index.dtype.names else np.dtype(np.uint8)
+            size = int(r['height']) * int(r['width']) * int(r['channels']) * dtype.itemsize
+            images.append(crops[r['offset']:(r['offset'] + size)].view(dtype).reshape(r['height'], r['width'], r['channels']))
+        
+        return images, index
+    
+    
+    
+    def crop_blocks(self, file_path, objects, output_dirpath=None, block_size=3, n_blocks=1000, random_state=None,
+                    writer=None, n_jobs=1, tile_cache_size=64):
     
         if output_dirpath is None:
             raise ValueError('crop_blocks` function requires `output_dir` to save cropped images.')
     
-        if not os.path.exists(output_dirpath):
-            os.mkdir(output_dirpath)
+        img = self.__open_image(file_path, cv2.IMREAD_COLOR, tile_cache_size)[0]
+        objects_dict = self.__group_objects(objects)
+        random_state = np.random.RandomState(random_state)
+        
+        # creat an empty directories to save cropped images
+        with _open_writer(writer) as writer:
+            writer.makedirs([output_dirpath] + [os.path.join(output_dirpath, class_label) for class_label in objects_dict])
+            
+            # crop blocks
+            for class_label, object_list in objects_dict.items():
+                _output_dirpath = os.path.join(output_dirpath, class_label)
+                
+                # crop a number of `n_blocks` blocks
+                blocks, object_index = self.__sample_blocks(img, object_list, block_size, n_blocks, random_state, n_jobs)
+                if blocks is None:
+                    continue
+                for i in range(n_blocks):
+                    output_img_name = '_'.join(map(str, object_list[object_index[i]])) + '_' + str(i) + '.png'
+                    writer.write(os.path.join(_output_dirpath, output_img_name), blocks[i], channel_order='BGR')
+            
+            writer.flush()
+        
+    
     
+    
+    def sample_blocks(self, img, objects, block_size=3, n_blocks=1000, random_state=None, n_jobs=1):
+        '''Sample blocks from objects in memory.
+        
+        The same as `crop_blocks`, but blocks are returned as arrays instead of
+        being saved as images. Objects and the positions and flips of blocks
+        are drawn at once, and the blocks are gathered by fancy indexing.
+        
+        Args:
+            img (str, numpy.ndarray, TiledImage): A path to an image or an image (height x width x channels).
+                                                  For `TiledImage`, only the objects are read, and the
+                                                  blocks are converted to uint8 BGR, the same as images
+                                                  read from a path with `cv2.IMREAD_COLOR`.
+            objects (list): Objects, a list of [class_label, xmin, ymin, xmax, ymax].
+            block_size (int): The height and width of blocks.
+            n_blocks (int): The number of blocks sampled from each class.
+            random_state (int): A seed of random numbers.
+            n_jobs (int): The number of threads to read objects of `TiledImage`.
+        
+        Returns:
+            dict: A dictionary whose keys are class labels and values are arrays
+                  of blocks (n_blocks x block_size x block_size x channels), uint8 BGR
+                  for a path or `TiledImage`, or the dtype of the given array. Classes
+                  whose objects are all smaller than `block_size` are skipped with a warning.
+        '''
+        
+        if isinstance(img, str):
+            img = self.__open_image(img, cv2.IMREAD_COLOR, 64)[0]
+        
+        blocks = {}
+        random_state = np.random.RandomState(random_state)
+        for class_label, object_list in self.__group_objects(objects).items():
+            _blocks = self.__sample_blocks(img, object_list, block_size, n_blocks, random_state, n_jobs)[0]
+            if _blocks is not None:
+                blocks[class_label] = _blocks
+        
+        return blocks
+    
+    
+    
+    def __group_objects(self, objects):
         # grouped objects by class labels
         objects_dict = {}
         for obj in objects:
             if obj[0] not in objects_dict:
                 objects_dict.update({obj[0]: []})
             objects_dict[obj[0]].append(obj)
+        return objects_dict
+    
+    
+    
+    def __sample_blocks(self, img, object_list, block_size, n_blocks, random_state, n_jobs=1):
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+        if img.ndim == 2:
+            img = img[:, :, np.newaxis]
         
+        # objects clipped by the image, and skip small objects, too small to crop a block from the object
+        bbox = np.array([obj[1:5] for obj in object_list], dtype=np.int64).reshape(-1, 4)
+        bbox[:, [0, 2]] = np.clip(bbox[:, [0, 2]], 0, img.shape[1])
+        bbox[:, [1, 3]] = np.clip(bbox[:, [1, 3]], 0, img.shape[0])
+        eligible = np.where((bbox[:, 2] - bbox[:, 0] >= block_size) & (bbox[:, 3] - bbox[:, 1] >= block_size))[0]
+        if len(eligible) == 0:
+            warnings.warn('No objects of `' + str(object_list[0][0]) + '` are larger than `block_size`, the class is skipped.')
+            return None, None
         
-        # crop blocks
-        for class_label, object_list in objects_dict.items():
-            
-            # creat an empty directories to save cropped images
-            _output_dirpath = os.path.join(output_dirpath, class_label)
-            if not os.path.exists(_output_dirpath):
-                os.mkdir(_output_dirpath)
-            
-            # crop a number of `n_blocks` blocks
-            i = 0
-            while  i < n_blocks:
-                obj = random.choice(object_list)
-                
-                # skip small objects, too small to crop a block from the object
-                if obj[4] - obj[2] < block_size or obj[3] - obj[1] < block_size:
-                    continue
-                
-                # set start position for cropping
-                yaxis = random.randint(obj[2], obj[4] - block_size)
-                xaxis = random.randint(obj[1], obj[3] - block_size)
-                
-                # crop a block from an object
-                img_cropped = img[yaxis:(yaxis + block_size), xaxis:(xaxis + block_size), :]
-                
-                # flip the cropped block
-                random_num = random.random()
-                if 0.25 < random_num and random_num <= 0.50:
-                    img_cropped = cv2.flip(img_cropped, 0)
-                elif 0.50 < random_num and random_num <= 0.75:
-                    img_cropped = cv2.flip(img_cropped, 1)
-                elif 0.75 < random_num and random_num <= 1:
-                    img_cropped = cv2.flip(img_cropped, -1)
-                
-                output_img_name = '_'.join(map(str, obj)) + '_' + str(i) + '.png'
-                cv2.imwrite(os.path.join(_output_dirpath, output_img_name), img_cropped)
-            
-                i += 1
+        # draw objects, start positions, and flips of all blocks at once
+        object_index = eligible[random_state.randint(0, len(eligible), size=n_blocks)]
+        _bbox = bbox[object_index]
+        xaxis = _bbox[:, 0] + (random_state.random_sample(n_blocks) * (_bbox[:, 2] - _bbox[:, 0] - block_size + 1)).astype(np.int64)
+        yaxis = _bbox[:, 1] + (random_state.random_sample(n_blocks) * (_bbox[:, 3] - _bbox[:, 1] - block_size + 1)).astype(np.int64)
+        flip_code = random_state.randint(0, 4, size=n_blocks)
         
-
+        # flip blocks by reversing the indexes, 1: vertical, 2: horizontal, 3: both
+        offsets = np.arange(block_size)
+        rows = yaxis[:, np.newaxis] + np.where(np.isin(flip_code, [1, 3])[:, np.newaxis], offsets[::-1], offsets)
+        cols = xaxis[:, np.newaxis] + np.where(np.isin(flip_code, [2, 3])[:, np.newaxis], offsets[::-1], offsets)
+        
+        if isinstance(img, np.ndarray):
+            blocks = img[rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+            return blocks, object_index
+        
+        # read each object from the tiled image, and gather the blocks from the object
+        blocks = np.empty((n_blocks, block_size, block_size, img.shape[2]), dtype=img.dtype)
+        
+        def __gather_blocks(k):
+            is_k = (object_index == k)
+            xmin, ymin, xmax, ymax = bbox[k]
+            region = img[ymin:ymax, xmin:xmax]
+            blocks[is_k] = region[(rows[is_k] - ymin)[:, :, np.newaxis], (cols[is_k] - xmin)[:, np.newaxis, :]]
+        
+        r = joblib.Parallel(n_jobs=n_jobs, prefer='threads', verbose=0)(
+                [joblib.delayed(__gather_blocks)(k) for k in np.unique(object_index)])
+        return self.__to_color(blocks), object_index
     
     
     
-    def __augmentation_rotation(self, img):
-        r = np.random.rand(1)
-        random_degree = random.uniform(0, 90)
+    def __to_color(self, blocks):
+        # convert blocks of TIFF images (RGB, native dtype) in the same way as `cv2.IMREAD_COLOR`,
+        # that is, to uint8 (16-bit images are shifted by 8 bits) and BGR (gray is repeated, alpha is dropped)
+        if blocks.dtype == np.uint16:
+            blocks = (blocks >> 8).astype(np.uint8)
+        elif np.issubdtype(blocks.dtype, np.floating):
+            blocks = self.__to_uint8(blocks)
+        elif blocks.dtype != np.uint8:
+            blocks = np.clip(blocks, 0, 255).astype(np.uint8)
+        if blocks.shape[3] < 3:
+            return np.repeat(blocks[:, :, :, :1], 3, axis=3)
+        return np.ascontiguousarray(blocks[:, :, :, 2::-1])
+    
+    
+    
+    def __augmentation_rotation(self, img, random_state=None):
+        random_state = np.random if random_state is None else random_state
+        random_degree = random_state.uniform(0, 90)
+        if self.backend == 'opencv':
+            # rotate around the center and enlarge the canvas to fit the rotated image
+            h, w = img.shape[:2]
+            M = cv2.getRotationMatrix2D(((w - 1) / 2, (h - 1) / 2), random_degree, 1.0)
+            _w = int(np.ceil(abs(w * M[0, 0]) + abs(h * M[0, 1])))
+            _h = int(np.ceil(abs(w * M[0, 1]) + abs(h * M[0, 0])))
+            M[0, 2] += (_w - w) / 2
+            M[1, 2] += (_h - h) / 2
+            img = cv2.warpAffine(img, M, (_w, _h), flags=cv2.INTER_LINEAR,
+                                 borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            return img.reshape(_h, _w, -1)
         img = skimage.transform.rotate(img, random_degree, resize=True, cval=0)
         return img
     
     
-    def __augmentation_flip(self, img):
-        r = np.random.rand(1)
+    def __augmentation_flip(self, img, random_state=None):
+        random_state = np.random if random_state is None else random_state
+        r = random_state.rand(1)
+        if self.backend == 'opencv':
+            if r < 2/3:
+                img = cv2.flip(img, 1 if r < 1/3 else 0).reshape(img.shape)
+            return img
         if r < 1/3:
             img = img[:, ::-1, :]
         elif r < 2/3:
@@ -274,47 +794,138 @@ class imgUtils:
         return img
     
     
-    def __augmentation_noise(self, img):
-        r = np.random.rand(1)
+    def __augmentation_noise(self, img, random_state=None):
+        random_state = np.random if random_state is None else random_state
+        seed = {_RANDOM_NOISE_SEED: random_state.randint(0, 2 ** 31 - 1)}
+        r = random_state.rand(1)
+        if self.backend == 'opencv':
+            modes = [(0.15, 'localvar'), (0.30, 'salt'), (0.45, 's&p'), (0.60, 'speckle'), (0.75, 'poisson'), (0.95, 'gaussian')]
+            for p, mode in modes:
+                if r < p:
+                    return self.__augmentation_noise_cv(img, mode, seed[_RANDOM_NOISE_SEED])
+            return img
         if r < 0.15:
-            img = skimage.util.random_noise(img, mode='localvar')
+            img = skimage.util.random_noise(img, mode='localvar', **seed)
         elif r < 0.30:
-            img = skimage.util.random_noise(img, mode='salt')
+            img = skimage.util.random_noise(img, mode='salt', **seed)
         elif r < 0.45:
-            img = skimage.util.random_noise(img, mode='s&p')
+            img = skimage.util.random_noise(img, mode='s&p', **seed)
         elif r < 0.60:
-            img = skimage.util.random_noise(img, mode='speckle', var=0.01)
+            img = skimage.util.random_noise(img, mode='speckle', var=0.01, **seed)
         elif r < 0.75:
-            img = skimage.util.random_noise(img, mode='poisson')
+            img = skimage.util.random_noise(img, mode='poisson', **seed)
         elif r < 0.95:
-            img = skimage.util.random_noise(img, mode='gaussian', var=0.01)
+            img = skimage.util.random_noise(img, mode='gaussian', var=0.01, **seed)
         img = img * 255
         img = img.astype(np.uint8)
         return img
     
     
-    def __augmentation_generate_background(self, img):
-        bg_img = self.__augmentation_flip(img)
+    def __augmentation_noise_cv(self, img, mode, seed):
+        # the same noises as `skimage.util.random_noise` with OpenCV random numbers in float32
+        cv2.setRNGSeed(int(seed))
+        _img = self.__to_float32(img)
+        # single-channel view, since the scalar parameters of `randn` and `randu` apply to the first channel only
+        noise = np.empty(_img.shape, dtype=np.float32)
+        _noise = noise.reshape(noise.shape[0], -1)
+        if mode in ['localvar', 'gaussian']:
+            cv2.randn(_noise, 0.0, 0.1)
+            _img = _img + noise
+        elif mode == 'speckle':
+            cv2.randn(_noise, 0.0, 0.1)
+            _img = _img + _img * noise
+        elif mode == 'salt':
+            cv2.randu(_noise, 0.0, 1.0)
+            _img[noise < 0.05] = 1.0
+        elif mode == 's&p':
+            cv2.randu(_noise, 0.0, 1.0)
+            _img[noise < 0.025] = 1.0
+            _img[(0.025 <= noise) & (noise < 0.05)] = 0.0
+        elif mode == 'poisson':
+            n_values = np.count_nonzero(np.bincount(img.ravel(), minlength=256)) if img.dtype == np.uint8 else len(np.unique(img))
+            n_values = 2 ** np.ceil(np.log2(max(n_values, 1)))
+            _img = (np.random.RandomState(seed).poisson(_img * n_values) / n_values).astype(np.float32)
+        _img = np.clip(_img, 0.0, 1.0, out=_img)
+        return self.__to_dtype(_img)
+    
+    
+    def __to_float32(self, img):
+        if img.dtype == np.uint8:
+            return img.astype(np.float32) / 255
+        return img.astype(np.float32)
+    
+    
+    def __to_dtype(self, img):
+        # float images in [0, 1] to the dtype of `opencv` backend
+        if self.dtype == np.uint8 and img.dtype != np.uint8:
+            return (img * 255).astype(np.uint8)
+        if self.dtype == np.float32 and img.dtype == np.uint8:
+            return img.astype(np.float32) / 255
+        return img.astype(self.dtype, copy=False)
+    
+    
+    def __to_uint8(self, img):
+        if img.dtype == np.uint8:
+            return img
+        return (np.clip(img, 0, 1) * 255).astype(np.uint8)
+    
+    
+    def __imread(self, image_path):
+        if self.backend == 'opencv':
+            img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+            if img is None:
+                raise ValueError('Unknown types of this file: ' + image_path + '.')
+            return self.__to_dtype(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        return skimage.io.imread(image_path)[:, :, :3]
+    
+    
+    def __augmentation_generate_background(self, img, block_size, random_state=None, scale=1.0):
+        # generate a background of `block_size` x `block_size`, which is the center of
+        # the template image flipped, cropped, scaled 5-8 times, and rotated, the affine
+        # transformations are composed and only the output block is computed
+        random_state = np.random if random_state is None else random_state
+        bg_img = self.__augmentation_flip(img, random_state)
         
         # crop background image
-        x0 = random.randint(0, int(bg_img.shape[0] / 3))
-        x1 = random.randint(int(2 * bg_img.shape[0] / 3), bg_img.shape[0])
-        y0 = random.randint(0, int(bg_img.shape[1] / 3))
-        y1 = random.randint(int(2 * bg_img.shape[1] / 3), bg_img.shape[1])
+        x0 = random_state.randint(0, int(bg_img.shape[0] / 3) + 1)
+        x1 = random_state.randint(int(2 * bg_img.shape[0] / 3), bg_img.shape[0] + 1)
+        y0 = random_state.randint(0, int(bg_img.shape[1] / 3) + 1)
+        y1 = random_state.randint(int(2 * bg_img.shape[1] / 3), bg_img.shape[1] + 1)
         bg_img = bg_img[x0:x1, y0:y1]
-            
-        # resize background image
-        w = random.randint(int(bg_img.shape[0] * 5), bg_img.shape[0] * 8)
-        h = random.randint(int(bg_img.shape[1] * 5), bg_img.shape[1] * 8)
-        bg_img = skimage.transform.resize(bg_img, (w, h), mode='constant')
+        if np.issubdtype(bg_img.dtype, np.integer):
+            bg_img = bg_img.astype(np.float32) / 255
+        else:
+            bg_img = np.ascontiguousarray(bg_img, dtype=np.float32)
+        
+        # scale and rotation of background image
+        w = random_state.randint(int(bg_img.shape[0] * 5), bg_img.shape[0] * 8 + 1) * scale
+        h = random_state.randint(int(bg_img.shape[1] * 5), bg_img.shape[1] * 8 + 1) * scale
+        theta = np.deg2rad(random_state.uniform(0, 90))
         
-        # rotate background image
-        bg_img = self.__augmentation_rotation(bg_img)
+        # map the output block to the cropped background image,
+        # rotate around the center (counter-clockwise), then scale
+        cos, sin = np.cos(theta), np.sin(theta)
+        scale_x = bg_img.shape[1] / h
+        scale_y = bg_img.shape[0] / w
+        c = (block_size - 1) / 2
+        rotation = np.array([[cos, -sin, (h - 1) / 2 - cos * c + sin * c],
+                             [sin, cos, (w - 1) / 2 - sin * c - cos * c]])
+        scaling = np.array([[scale_x, 0, 0.5 * scale_x - 0.5],
+                            [0, scale_y, 0.5 * scale_y - 0.5]])
+        M = scaling[:, :2] @ rotation
+        M[:, 2] += scaling[:, 2]
+        bg_img = cv2.warpAffine(bg_img, M, (block_size, block_size),
+                                flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        if bg_img.ndim == 2:
+            bg_img = bg_img[:, :, np.newaxis]
        
         # filter
-        r = np.random.rand(1)
+        r = random_state.rand(1)
         if r > 0.5:
-            bg_img = skimage.filters.gaussian(bg_img, sigma=random.uniform(0.5, 2.0), multichannel=True)
+            bg_img = cv2.GaussianBlur(bg_img, (0, 0), random_state.uniform(0.5, 2.0), borderType=cv2.BORDER_REPLICATE)
+            if bg_img.ndim == 2:
+                bg_img = bg_img[:, :, np.newaxis]
         
         return bg_img
  
@@ -351,26 +962,27 @@ class imgUtils:
         
         
         
-    def __augmentation_fill_background(self, img, bg_img_tmpl):
+    def __augmentation_fill_background(self, img, bg_img_tmpl, random_state=None):
         
        
         
         block_size = img.shape[0] if img.shape[0] > img.shape[1] else img.shape[1]
         
-        # get background and crop it to nxn sizes block
-        bg_img = self.__augmentation_generate_background(bg_img_tmpl)
-        x0 = int((bg_img.shape[0] - block_size) / 2)
-        x1 = x0 + block_size
-        y0 = int((bg_img.shape[1] - block_size) / 2)
-        y1 = y0 + block_size
-        bg_img = bg_img[x0:x1, y0:y1]
+        # get background of nxn sizes block
+        bg_img = self.__augmentation_generate_background(bg_img_tmpl, block_size, random_state)
         
         img = self.__get_padding(img)
         
         # make mask
-        mask = skimage.color.rgb2gray(img)
-        mask = np.pad(skimage.transform.resize(mask, (mask.shape[0] - 10, mask.shape[1] - 10), mode='constant'),
-                      5, self.__zero_padding)
+        if self.backend == 'opencv':
+            bg_img = self.__to_dtype(bg_img).reshape(img.shape)
+            mask = self.__to_float32(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY))
+            mask = cv2.copyMakeBorder(cv2.resize(mask, (mask.shape[1] - 10, mask.shape[0] - 10), interpolation=cv2.INTER_LINEAR),
+                                      5, 5, 5, 5, cv2.BORDER_CONSTANT, value=0)
+        else:
+            mask = skimage.color.rgb2gray(img)
+            mask = np.pad(skimage.transform.resize(mask, (mask.shape[0] - 10, mask.shape[1] - 10), mode='constant'),
+                          5, self.__zero_padding)
         
         img[mask < 0.001] = bg_img[mask < 0.001]
         return img
@@ -378,235 +990,615 @@ class imgUtils:
         
     
     
-    def augmentation_ss(self, input_path=None, output_dirpath=None, n=100, output_prefix='augmented_image'):
+    def __augmentation_pipeline(self, img, bg_img, img_file=None, random_state=None):
+        # randomly rotation
+        img_ag = self.__augmentation_rotation(img, random_state)
         
+        # fill up background (some case can not perform zero-padding)
+        try:
+            img_ag = self.__augmentation_fill_background(img_ag, bg_img, random_state)
+        except (ValueError, IndexError, cv2.error) as e:
+            warnings.warn('Failed to fill up background of image: ' + str(img_file) + ' (' + str(e) + '), '
+                          'the image is used without background.')
         
-        if os.path.isfile(input_path):
+        # randomly reflection
+        img_ag = self.__augmentation_flip(img_ag, random_state)
+        
+        # randomly add noises
+        img_ag = self.__augmentation_noise(img_ag, random_state)
+        
+        return img_ag
+    
+    
+    
+    def __list_image_files(self, input_path):
+        if input_path is None:
+            return []
+        if isinstance(input_path, Manifest):
+            image_files = input_path.file_paths()
+        elif os.path.isfile(input_path):
             image_files = [input_path]
         elif os.path.isdir(input_path):
-            image_files = [os.path.join(input_path, f) for f in os.listdir(input_path) if os.path.isfile(os.path.join(input_path, f))]
+            image_files = [os.path.join(input_path, f) for f in os.listdir(input_path) if os.path.isfile(os.path.join(input_path, f)) and (not f.startswith('.'))]
         else:
             raise ValueError('Unknown types of this file: ' + input_path + '.')
+        return image_files
+    
+    
+    
+    def __augmentation_plan(self, n, image_files, bg_image_files, random_state):
+        # draw source and background images and seeds of all outputs at once
+        random_state = np.random.RandomState(random_state)
+        return {'source': random_state.randint(0, len(image_files), size=n),
+                'background': random_state.randint(0, len(bg_image_files), size=n) if len(bg_image_files) > 0 else np.full(n, -1),
+                'seed': random_state.randint(0, 2 ** 31 - 1, size=n),
+                'image_files': image_files, 'bg_image_files': bg_image_files}
+    
+    
+    
+    def __augmentation_chunks(self, plan, n_jobs, chunk_size):
+        # split the outputs sorted by the source images into chunks
+        n = len(plan['seed'])
+        if chunk_size is None:
+            chunk_size = min(1000, max(1, int(np.ceil(n / (4 * joblib.effective_n_jobs(n_jobs))))))
+        order = np.lexsort((plan['background'], plan['source']))
+        return [self.__plan_chunk(plan, order[i:(i + chunk_size)]) for i in range(0, n, chunk_size)]
+    
+    
+    
+    def __plan_chunk(self, plan, output_ids):
+        # slices of the plan for the outputs, with only the image files referred by the outputs,
+        # so that a task is sent with O(chunk_size) data
+        source, source_inv = np.unique(plan['source'][output_ids], return_inverse=True)
+        background = plan['background'][output_ids]
+        bg_image_files = []
+        if len(plan['bg_image_files']) > 0:
+            _background, background = np.unique(background, return_inverse=True)
+            bg_image_files = [plan['bg_image_files'][k] for k in _background.tolist()]
+        return {'output_id': output_ids, 'source': source_inv.reshape(-1), 'background': background.reshape(-1),
+                'seed': plan['seed'][output_ids],
+                'image_files': [plan['image_files'][k] for k in source.tolist()], 'bg_image_files': bg_image_files}
+    
+    
+    
+    def __augmentation_outputs(self, chunk):
+        # augment the outputs of the chunk, each source image is decoded once in the sorted outputs
+        cache = {'source': (None, None), 'background': (None, None)}
+        
+        def __imread(k, image_path):
+            if cache[k][0] != image_path:
+                cache[k] = (image_path, self.__imread(image_path))
+            return cache[k][1]
+        
+        for i, source, background, seed in zip(chunk['output_id'].tolist(), chunk['source'].tolist(),
+                                               chunk['background'].tolist(), chunk['seed'].tolist()):
+            img_file = chunk['image_files'][source]
+            img = __imread('source', img_file)
+            bg_img = img if background < 0 else __imread('background', chunk['bg_image_files'][background])
+            yield i, self.__augmentation_pipeline(img, bg_img, img_file, np.random.RandomState(seed))
+    
+    
+    
+    def augmentation_ss(self, input_path=None, output_dirpath=None, n=100, output_prefix='augmented_image', random_state=None,
+                        writer=None):
+        
+        image_files = self.__list_image_files(input_path)
+        plan = self.__augmentation_plan(n, image_files, [], random_state)
+        with _open_writer(writer) as writer:
+            
+            for chunk in self.__augmentation_chunks(plan, 1, n):
+                for i, img_ag in self.__augmentation_outputs(chunk):
+                    new_file_path = os.path.join(output_dirpath, output_prefix + '_' + str(i + 1) + '.png')
+                    writer.write(new_file_path, self.__to_uint8(img_ag))
+            writer.flush()
+
+
+
+    
+    def augmentation(self, input_path=None, output_dirpath=None, n=100, output_prefix='augmented_image', n_jobs=-1,
+                     random_state=None, chunk_size=None, writer=None):
+        '''Augment images.
+        
+        Source images and seeds of all outputs are drawn at once before augmentation.
+        The outputs are grouped by source images and sent to workers in chunks,
+        so that each source image is decoded once in a chunk. Since each output
+        is augmented with its own seed, the results are reproducible with
+        `random_state` regardless of `n_jobs` and `chunk_size`.
+        
+        Args:
+            input_path (str, Manifest): A path to an image or a directory of images, or a manifest.
+            output_dirpath (str): A path to a directory to save augmented images.
+            n (int): The number of augmented images.
+            output_prefix (str): A prefix of file names of augmented images.
+            n_jobs (int): The number of processes.
+            random_state (int): A seed of random numbers.
+            chunk_size (int): The number of outputs in a task.
+            writer (ImageWriter): A writer which decides the image format, PNG by default.
+        '''
         
-        n = n + 1
-        i = 1
-        while i < n:
+        image_files = self.__list_image_files(input_path)
+        plan = self.__augmentation_plan(n, image_files, [], random_state)
+        with _open_writer(writer) as writer:
+            
+            def __augmentation_chunk(chunk):
+                for i, img_ag in self.__augmentation_outputs(chunk):
+                    new_file_path = os.path.join(output_dirpath, output_prefix + '_' + str(i + 1) + '.png')
+                    writer.write(new_file_path, self.__to_uint8(img_ag))
+                writer.flush()
             
-            # randomly chose an image from the directory
-            image_path = random.choice(image_files)
             
-            img = skimage.io.imread(image_path)[:, :, :3]
+            chunks = self.__augmentation_chunks(plan, n_jobs, chunk_size)
             
-            # randomly rotation
-            img_ag = self.__augmentation_rotation(img)
             
-            # fill up background (some case can not perform zero-padding)
-            _img_ag = self.__augmentation_fill_background(img_ag, img)
-            if _img_ag is None:
-                print('==> aug found None image in __augmentation_fill_background: ' + input_path + '.')
-                _img_ag = img_ag
-            img_ag = _img_ag
+            r = joblib.Parallel(n_jobs=n_jobs, verbose=0)([joblib.delayed(__augmentation_chunk)(chunk) for chunk in chunks])
+
+
+
 
-           
-            # randomly reflection
-            img_ag = self.__augmentation_flip(img_ag)
+    def synthesis(self, input_path=None, bg_path=None, output_dirpath=None, n=100, output_prefix='synthetic_image', n_jobs=-1,
+                  random_state=None, chunk_size=None, writer=None):
+        '''Synthesize images by putting objects on backgrounds.
+        
+        The outputs are planned, grouped by object images, and augmented in
+        chunks in the same way as `augmentation`.
+        
+        Args:
+            input_path (str, Manifest): A path to an image or a directory of object images, or a manifest.
+            bg_path (str, Manifest): A path to an image or a directory of background images, or a manifest.
+            output_dirpath (str): A path to a directory to save synthetic images.
+            n (int): The number of synthetic images.
+            output_prefix (str): A prefix of file names of synthetic images.
+            n_jobs (int): The number of processes.
+            random_state (int): A seed of random numbers.
+            chunk_size (int): The number of outputs in a task.
+            writer (ImageWriter): A writer which decides the image format, PNG by default.
+        '''
+        
+        # make mask and background image lists for random sampling afterward
+        mask_image_files = self.__list_image_files(input_path)
+        bg_image_files = self.__list_image_files(bg_path)
+        plan = self.__augmentation_plan(n, mask_image_files, bg_image_files, random_state)
+        with _open_writer(writer) as writer:
             
-            # randomly add noises
-            img_ag = self.__augmentation_noise(img_ag)
+            def __synthesis_chunk(chunk):
+                for i, img_ag in self.__augmentation_outputs(chunk):
+                    new_file_path = os.path.join(output_dirpath, output_prefix + '_' + str(i + 1) + '.png')
+                    writer.write(new_file_path, self.__to_uint8(img_ag))
+                writer.flush()
+                
             
-            new_file_path = os.path.join(output_dirpath, output_prefix + '_' + str(i) + '.png')
-            skimage.io.imsave(new_file_path, img_ag)
+            chunks = self.__augmentation_chunks(plan, n_jobs, chunk_size)
+                
             
-            i = i + 1
+            r = joblib.Parallel(n_jobs=n_jobs, verbose=0)([joblib.delayed(__synthesis_chunk)(chunk) for chunk in chunks])
 
 
 
-    
-    def augmentation(self, input_path=None, output_dirpath=None, n=100, output_prefix='augmented_image', n_jobs=-1):
+
+    def __read_foreground(self, image_path, threshold):
+        # foreground (BGR) and its mask (uint8), the mask is the alpha channel,
+        # or pixels brighter than `threshold` cleaned by morphological opening and erosion
+        img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError('Unknown types of this file: ' + image_path + '.')
+        if img.dtype != np.uint8:
+            img = (img // 257).astype(np.uint8) if img.dtype == np.uint16 else self.__to_uint8(img)
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
         
-        if os.path.isfile(input_path):
-            image_files = [input_path]
-        elif os.path.isdir(input_path):
-            image_files = [os.path.join(input_path, f) for f in os.listdir(input_path) if os.path.isfile(os.path.join(input_path, f)) and (not f.startswith('.'))]
+        if img.shape[2] == 4:
+            mask = np.ascontiguousarray(img[:, :, 3])
+            img = np.ascontiguousarray(img[:, :, :3])
         else:
-            raise ValueError('Unknown types of this file: ' + input_path + '.')
+            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+            mask = cv2.threshold(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), threshold, 255, cv2.THRESH_BINARY)[1]
+            mask = cv2.erode(cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel), kernel)
         
+        # crop the foreground to the mask
+        x, y, w, h = cv2.boundingRect(mask)
+        return img[y:(y + h), x:(x + w)], mask[y:(y + h), x:(x + w)]
+    
+    
+    
+    def __composite_scene(self, scene, foregrounds, random_state, n_objects, scale_range):
+        # paste foregrounds at random positions, with random scales, rotations, and flips,
+        # and return the scene and the bounding boxes of the pasted foregrounds
+        h, w = scene.shape[:2]
+        objects = []
         
-        def __augmentation_ss(i):
-            # randomly chose an image from the directory
-            img_file = random.choice(image_files)
-            img = skimage.io.imread(img_file)[:, :, :3]
+        for _ in range(random_state.randint(n_objects[0], n_objects[1] + 1)):
+            fg_img, mask, class_label = foregrounds(random_state.randint(0, 2 ** 31 - 1))
+            if fg_img.size == 0:
+                continue
             
-            # randomly rotation
-            img_ag = self.__augmentation_rotation(img)
-            
-            # fill up background (some case can not perform zero-padding)
-            try:
-                img_ag = self.__augmentation_fill_background(img_ag, img)
-            except:
-                print('image: ' + img_file)
+            # the longest edge of the rotated foreground is at most the shorter edge of the scene
+            fh, fw = mask.shape
+            scale = random_state.uniform(scale_range[0], scale_range[1]) * min(h, w) / max(fh, fw)
+            scale = min(scale, min(h, w) / np.sqrt(fh * fh + fw * fw))
+            M = cv2.getRotationMatrix2D(((fw - 1) / 2, (fh - 1) / 2), random_state.uniform(0, 360), scale)
+            _w = max(1, min(w, int(np.ceil(abs(fw * M[0, 0]) + abs(fh * M[0, 1])))))
+            _h = max(1, min(h, int(np.ceil(abs(fw * M[0, 1]) + abs(fh * M[0, 0])))))
+            M[0, 2] += (_w - fw) / 2
+            M[1, 2] += (_h - fh) / 2
+            fg_img = cv2.warpAffine(fg_img, M, (_w, _h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            mask = cv2.warpAffine(mask, M, (_w, _h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            flip_code = random_state.randint(0, 4)
+            if flip_code > 0:
+                fg_img = cv2.flip(fg_img, [0, 1, -1][flip_code - 1])
+                mask = cv2.flip(mask, [0, 1, -1][flip_code - 1])
             
-            # randomly reflection
-            img_ag = self.__augmentation_flip(img_ag)
+            # alpha blending in the region of the foreground
+            x = random_state.randint(0, w - _w + 1)
+            y = random_state.randint(0, h - _h + 1)
+            roi = scene[y:(y + _h), x:(x + _w)]
+            alpha = mask[:, :, np.newaxis].astype(np.uint16)
+            roi[:] = ((fg_img * alpha + roi * (255 - alpha) + 127) // 255).astype(np.uint8)
             
-            # randomly add noises
-            img_ag = self.__augmentation_noise(img_ag)
-            
-            new_file_path = os.path.join(output_dirpath, output_prefix + '_' + str(i) + '.png')
-            skimage.io.imsave(new_file_path, img_ag)
+            bx, by, bw, bh = cv2.boundingRect(mask)
+            if bw > 0 and bh > 0:
+                objects.append([class_label, x + bx, y + by, x + bx + bw, y + by + bh])
         
+        return scene, objects
+    
+    
+    
+    def __write_PascalVOC(self, xml_path, image_path, img_shape, objects):
+        root = ET.Element('annotation')
+        ET.SubElement(root, 'folder').text = os.path.basename(os.path.dirname(os.path.abspath(image_path)))
+        ET.SubElement(root, 'filename').text = os.path.basename(image_path)
+        size = ET.SubElement(root, 'size')
+        for tag, v in zip(['width', 'height', 'depth'], [img_shape[1], img_shape[0], img_shape[2]]):
+            ET.SubElement(size, tag).text = str(v)
+        for obj in objects:
+            _obj = ET.SubElement(root, 'object')
+            ET.SubElement(_obj, 'name').text = obj[0]
+            ET.SubElement(_obj, 'pose').text = 'Unspecified'
+            ET.SubElement(_obj, 'truncated').text = '0'
+            ET.SubElement(_obj, 'difficult').text = '0'
+            bndbox = ET.SubElement(_obj, 'bndbox')
+            for tag, v in zip(['xmin', 'ymin', 'xmax', 'ymax'], obj[1:5]):
+                ET.SubElement(bndbox, tag).text = str(int(v))
+        tree = ET.ElementTree(root)
+        ET.indent(tree, space='\t')
+        tree.write(xml_path)
+    
+    
+    
+    def composite(self, input_path=None, bg_path=None, output_dirpath=None, n=100, n_objects=(1, 10),
+                  scale_range=(0.1, 0.3), output_size=None, threshold=1, output_prefix='composite_image',
+                  n_jobs=-1, random_state=None, chunk_size=None, writer=None):
+        '''Synthesize scenes of multiple objects with Pascal VOC annotations.
         
-        r = joblib.Parallel(n_jobs=n_jobs, verbose=0)([joblib.delayed(__augmentation_ss)(i + 1) for i in range(n)])
-
-
-
-
-    def synthesis(self, input_path=None, bg_path=None, output_dirpath=None, n=100, output_prefix='synthetic_image', n_jobs=-1):
+        Foreground images are pasted on each background at random positions,
+        scales, rotations, and flips. Masks of foregrounds are the alpha
+        channels (4-channel images), or the pixels brighter than `threshold`
+        cleaned by morphological opening and erosion, computed once for each
+        foreground image in uint8. Foregrounds are rotated and blended only in
+        their regions of the scene. Each scene is saved with a Pascal VOC XML
+        file of the bounding boxes of the foregrounds, whose class labels are
+        the names of the directories of the foreground images (or the class
+        labels of the manifest). Scenes are planned and grouped by backgrounds
+        in the same way as `synthesis`, and reproducible with `random_state`.
         
-        mask_image_files = []
-        bg_image_files = []
+        Args:
+            input_path (str, Manifest): A path to an image or a directory of foreground images, or a manifest.
+            bg_path (str, Manifest): A path to an image or a directory of background images, or a manifest.
+            output_dirpath (str): A path to a directory to save scenes and XML files.
+            n (int): The number of scenes.
+            n_objects (int, tuple): The number (or the minimum and maximum) of foregrounds in a scene.
+            scale_range (tuple): The range of the longest edge of foregrounds relative to the shorter edge of scenes.
+            output_size (tuple): The width and height of scenes, the sizes of backgrounds by default.
+            threshold (int): Pixels of gray scale foregrounds brighter than it are the foregrounds.
+            output_prefix (str): A prefix of file names of scenes.
+            n_jobs (int): The number of processes.
+            random_state (int): A seed of random numbers.
+            chunk_size (int): The number of scenes in a task.
+            writer (ImageWriter): A writer which decides the image format, PNG by default.
+        '''
         
+        if output_dirpath is None:
+            raise ValueError('`composite` function requires `output_dirpath` to save images.')
+        if isinstance(n_objects, int):
+            n_objects = (n_objects, n_objects)
         
-        # make mask image list for random sampling afterward
-        if os.path.isfile(input_path):
-            mask_image_files = [input_path]
-        elif os.path.isdir(input_path):
-            mask_image_files = [os.path.join(input_path, f) for f in os.listdir(input_path) if os.path.isfile(os.path.join(input_path, f)) and (not f.startswith('.'))]
-
-        # make background image list for random sampling afterward
-        if os.path.isfile(bg_path):
-            bg_image_files = [bg_path]
-        elif os.path.isdir(bg_path):
-            bg_image_files = [os.path.join(bg_path, f) for f in os.listdir(bg_path) if os.path.isfile(os.path.join(bg_path, f)) and (not f.startswith('.'))]
+        fg_image_files = self.__list_image_files(input_path)
+        bg_image_files = self.__list_image_files(bg_path)
+        if isinstance(input_path, Manifest):
+            fg_class_labels = [c if c != '' else os.path.basename(os.path.dirname(f))
+                               for c, f in zip(input_path.class_label.tolist(), fg_image_files)]
+        else:
+            fg_class_labels = [os.path.basename(os.path.dirname(os.path.abspath(f))) for f in fg_image_files]
         
-        def __synthesis_ss(i):
-            # load images to objects
-            mask_image_file = random.choice(mask_image_files)
-            bg_image_file = random.choice(bg_image_files)
-            mask_image = skimage.io.imread(mask_image_file)[:, :, :3]
-            bg_image = skimage.io.imread(bg_image_file)[:, :, :3]
+        # plan backgrounds and seeds of scenes, grouped by backgrounds
+        plan = self.__augmentation_plan(n, bg_image_files, [], random_state)
+        with _open_writer(writer) as writer:
+            writer.makedirs([output_dirpath])
+            
+            def __composite_chunk(chunk):
+                cache = collections.OrderedDict()
+                bg = {'path': None, 'img': None}
+                
+                def __foregrounds(seed):
+                    j = seed % len(fg_image_files)
+                    if j not in cache:
+                        cache[j] = self.__read_foreground(fg_image_files[j], threshold)
+                        if len(cache) > 64:
+                            cache.popitem(last=False)
+                    return cache[j] + (fg_class_labels[j], )
+                
+                for i, source, seed in zip(chunk['output_id'].tolist(), chunk['source'].tolist(), chunk['seed'].tolist()):
+                    bg_image_file = chunk['image_files'][source]
+                    if bg['path'] != bg_image_file:
+                        bg['path'] = bg_image_file
+                        bg['img'] = cv2.imread(bg_image_file, cv2.IMREAD_COLOR)
+                        if output_size is not None:
+                            bg['img'] = cv2.resize(bg['img'], tuple(output_size), interpolation=cv2.INTER_AREA)
+                    
+                    scene, objects = self.__composite_scene(bg['img'].copy(), __foregrounds,
+                                                            np.random.RandomState(seed), n_objects, scale_range)
+                    
+                    new_file_path = writer.write(os.path.join(output_dirpath, output_prefix + '_' + str(i + 1) + '.png'),
+                                                 scene, channel_order='BGR')
+                    self.__write_PascalVOC(os.path.splitext(new_file_path)[0] + '.xml', new_file_path, scene.shape, objects)
+                writer.flush()
             
-        
-            img_ag = self.__augmentation_rotation(mask_image)
-            try:
-                img_ag = self.__augmentation_fill_background(img_ag, bg_image)
-            except:
-                print('maskimage: ' + mask_image_file)
-                print('bgimage: ' + bg_image_file)
-                print(bg_image.shape)
-                print(img_ag.shape)
-                print('--------')
             
-            img_ag = self.__augmentation_flip(img_ag)
-            img_ag = self.__augmentation_noise(img_ag)
+            chunks = self.__augmentation_chunks(plan, n_jobs, chunk_size)
             
-            new_file_path = os.path.join(output_dirpath, output_prefix + '_' + str(i) + '.png')
-            skimage.io.imsave(new_file_path, img_ag)
             
+            r = joblib.Parallel(n_jobs=n_jobs, verbose=0)([joblib.delayed(__composite_chunk)(chunk) for chunk in chunks])
+    
+    
+    
+    
+    def iter_augmentation(self, input_path=None, bg_path=None, n=100, batch_size=32, output_size=(256, 256),
+                          random_state=None, prefetch=2, n_jobs=-1):
+        '''Generate batches of augmented images in memory.
         
-        r = joblib.Parallel(n_jobs=n_jobs, verbose=0)([joblib.delayed(__synthesis_ss)(i + 1) for i in range(n)])
-
+        Images are augmented in the same way as `augmentation` (or `synthesis`
+        if `bg_path` is given) by worker processes, and the workers write the
+        augmented images into slots of a buffer in shared memory
+        (a memory-mapped file under /dev/shm), so that the images are passed to
+        the main process without encoding, writing, and decoding image files.
+        A slot is refilled with the next batch as soon as its batch is copied
+        out, before the batch is yielded, so that workers keep augmenting the
+        following batches while the consumer uses the current one.
+        
+        Args:
+            input_path (str, Manifest): A path to an image or a directory of images, or a manifest.
+            bg_path (str, Manifest): A path to an image or a directory of background images, or a manifest.
+                           If `None`, backgrounds are generated from the input images.
+            n (int): The number of augmented images.
+            batch_size (int): The number of images in a batch.
+            output_size (tuple): The height and width of augmented images.
+            random_state (int): A seed of random numbers.
+            prefetch (int): The number of batches augmented in advance by a worker.
+            n_jobs (int): The number of processes.
+        
+        Returns:
+            iterator: An iterator of batches (batch_size x height x width x 3), uint8,
+                      or `dtype` of `opencv` backend,
+                      the last batch may contain less than `batch_size` images.
+        '''
+        
+        if isinstance(output_size, int):
+            output_size = (output_size, output_size)
+        image_files = self.__list_image_files(input_path)
+        bg_image_files = self.__list_image_files(bg_path)
+        
+        plan = self.__augmentation_plan(n, image_files, bg_image_files, random_state)
+        batch_sizes = [min(batch_size, n - i) for i in range(0, n, batch_size)]
+        n_slots = max(1, joblib.effective_n_jobs(n_jobs)) * prefetch
+        
+        buff_dirpath = tempfile.mkdtemp(dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        buff_path = os.path.join(buff_dirpath, 'augmentation.buff')
+        buff_shape = (n_slots, batch_size, output_size[0], output_size[1], 3)
+        buff_dtype = self.dtype if self.backend == 'opencv' else np.uint8
         
+        def __batch_chunk(batch_id):
+            # the outputs of the batch in order of the source images
+            batch_from = batch_id * batch_size
+            output_ids = np.arange(batch_from, batch_from + batch_sizes[batch_id])
+            output_ids = output_ids[np.lexsort((plan['background'][output_ids], plan['source'][output_ids]))]
+            return self.__plan_chunk(plan, output_ids)
+        
+        def __augmentation_batch(slot, batch_from, chunk):
+            buff = np.memmap(buff_path, dtype=buff_dtype, mode='r+', shape=buff_shape)
+            for i, img_ag in self.__augmentation_outputs(chunk):
+                buff[slot, i - batch_from] = cv2.resize(img_ag.astype(buff_dtype, copy=False), (output_size[1], output_size[0]), interpolation=cv2.INTER_AREA)
+            buff.flush()
+            del buff
+            return slot
+        
+        executor = get_reusable_executor(max_workers=max(1, joblib.effective_n_jobs(n_jobs)))
+        futures = collections.deque()
+        
+        def __submit(b):
+            if b < len(batch_sizes):
+                futures.append((b, executor.submit(__augmentation_batch, b % n_slots, b * batch_size, __batch_chunk(b))))
+        
+        try:
+            buff = np.memmap(buff_path, dtype=buff_dtype, mode='w+', shape=buff_shape)
+            for b in range(n_slots):
+                __submit(b)
+            while len(futures) > 0:
+                b, future = futures.popleft()
+                slot = future.result()
+                batch = np.array(buff[slot, :batch_sizes[b]])
+                # the slot is free, augment the next batch while the consumer uses this batch
+                __submit(b + n_slots)
+                yield batch
+            del buff
+        finally:
+            for _, future in futures:
+                future.cancel()
+            shutil.rmtree(buff_dirpath, ignore_errors=True)
+    
     
     
-    def resize(self, input_path, size = (1024, 768), output_dirpath=None, output_prefix='resized_image', n_jobs=-1):
+    
+    def __transform_PascalVOC(self, xml_path, output_xml_path, resize_ratio, shift_w, shift_h, img_shape):
+        # rewrite image size and bounding boxes of all objects through the parsed XML tree
+        tree = ET.parse(xml_path)
+        root = tree.getroot()
+        size = root.find('size')
+        if size is not None:
+            for tag, v in [('width', img_shape[1]), ('height', img_shape[0])]:
+                if size.find(tag) is not None:
+                    size.find(tag).text = str(v)
         
-       
-        def __resize(img_path, size, output_dirpath, output_prefix):
-            print(img_path)
-            # open the original image
-            img_original = skimage.io.imread(img_path)[:, :, :3]
-            h, w, c = img_original.shape
-            
-            resize_ratio = None
-            if max(h, w) == h:
-                resize_ratio = size[1] / h
-            else:
-                resize_ratio = size[0] / w
-        
-            # resize the original image to target size
-            img = skimage.transform.rescale(img_original, resize_ratio, mode='reflect', anti_aliasing=True, multichannel=True)
-        
-            # make background
-            img_original_2x = skimage.transform.rescale(img_original, 1.5, mode='reflect', anti_aliasing=True, multichannel=True)
-            bg_img = self.__augmentation_generate_background(img_original_2x)
-            bh, bw, bc = bg_img.shape
-            block_size = img.shape[0] if img.shape[0] > img.shape[1] else img.shape[1]
-            x0 = int((bg_img.shape[0] - block_size) / 2)
-            x1 = x0 + block_size
-            y0 = int((bg_img.shape[1] - block_size) / 2)
-            y1 = y0 + block_size
-            bg_img = bg_img[x0:x1, y0:y1]
-        
-            # synthesis
-            img = self.__get_padding(img)
-            mask = skimage.color.rgb2gray(img)
-            mask = np.pad(skimage.transform.resize(mask, (mask.shape[0] - 2, mask.shape[1] - 2), mode='constant'),
-                          1, self.__zero_padding)
-            img[mask < 0.001] = bg_img[mask < 0.001]
-        
-            # print out resized image
-            if output_dirpath is None:
-                output_dirpath = ''
-            new_file_path = os.path.join(output_dirpath, output_prefix + '_' + os.path.basename(img_path))
-            skimage.io.imsave(new_file_path, img)
-        
-            # print out xml, if given
-            xml_path = os.path.splitext(img_path)[0] + '.xml'
-            new_file_path = os.path.join(output_dirpath, output_prefix + '_' + os.path.basename(xml_path))
-            print(new_file_path)
-            if xml_path is not None:
-                # shift
+        bndboxes = [obj.find('bndbox') for obj in root.iter('object') if obj.find('bndbox') is not None]
+        tags = ['xmin', 'ymin', 'xmax', 'ymax']
+        if len(bndboxes) > 0:
+            bbox = np.array([[float(bndbox.find(tag).text) for tag in tags] for bndbox in bndboxes])
+            bbox = (bbox * resize_ratio + np.array([shift_w, shift_h, shift_w, shift_h])).astype(np.int64)
+            for bndbox, _bbox in zip(bndboxes, bbox.tolist()):
+                for tag, v in zip(tags, _bbox):
+                    bndbox.find(tag).text = str(v)
+        
+        tree.write(output_xml_path)
+    
+    
+    
+    def resize(self, input_path, size = (1024, 768), output_dirpath=None, output_prefix='resized_image', n_jobs=-1, fast=False,
+               writer=None):
+        '''Resize images and the bounding boxes of the Pascal VOC XML files.
+        
+        Images are resized to fit `size` keeping their aspect ratio, and padded to
+        squares with backgrounds generated from the images. If `fast` is `True`,
+        images are processed in uint8 with OpenCV, JPEG images are decoded at
+        1/2, 1/4, or 1/8 resolution (DCT-domain reduced decoding) if it is still
+        larger than the target size, and backgrounds are generated from the
+        resized images instead of the 1.5 times rescaled original images.
+        
+        Args:
+            input_path (str, Manifest): A path to an image or a directory of images, or a manifest.
+            size (tuple): The target width and height.
+            output_dirpath (str): A path to a directory to save resized images.
+            output_prefix (str): A prefix of file names of resized images.
+            n_jobs (int): The number of processes.
+            fast (bool): Use the fast path.
+            writer (ImageWriter): A writer which decides the image format,
+                                  the same as the original images by default.
+        '''
+        
+        if output_dirpath is None:
+            output_dirpath = ''
+        with _open_writer(writer) as writer:
+            
+            def __resize(img_path, size, output_dirpath, output_prefix):
+                # open the original image
+                img_original = skimage.io.imread(img_path)[:, :, :3]
+                h, w, c = img_original.shape
+                
+                resize_ratio = None
                 if max(h, w) == h:
-                    shift_h = 0
-                    shift_w = (h - w) * resize_ratio / 2
+                    resize_ratio = size[1] / h
                 else:
-                    shift_w = 0
-                    shift_h = (w - h) * resize_ratio / 2
+                    resize_ratio = size[0] / w
+            
+                # resize the original image to target size
+                img = skimage.transform.rescale(img_original, resize_ratio, mode='reflect', anti_aliasing=True, channel_axis=-1)
+            
+                # make background
+                img_original_2x = skimage.transform.rescale(img_original, 1.5, mode='reflect', anti_aliasing=True, channel_axis=-1)
+                block_size = img.shape[0] if img.shape[0] > img.shape[1] else img.shape[1]
+                bg_img = self.__augmentation_generate_background(img_original_2x, block_size)
+            
+                # synthesis
+                resized_shape = img.shape
+                img = self.__get_padding(img)
+                mask = skimage.color.rgb2gray(img)
+                mask = np.pad(skimage.transform.resize(mask, (mask.shape[0] - 2, mask.shape[1] - 2), mode='constant'),
+                              1, self.__zero_padding)
+                img[mask < 0.001] = bg_img[mask < 0.001]
+            
+                # print out resized image
+                new_file_path = os.path.join(output_dirpath, output_prefix + '_' + os.path.basename(img_path))
+                writer.write(new_file_path, self.__to_uint8(img))
                 
-                re_width = re.compile(r'<width>([0-9]+)</width>')
-                re_height = re.compile(r'<height>([0-9]+)</height>')
-                re_xmin = re.compile(r'<xmin>([0-9]+)</xmin>')
-                re_xmax = re.compile(r'<xmax>([0-9]+)</xmax>')
-                re_ymin = re.compile(r'<ymin>([0-9]+)</ymin>')
-                re_ymax = re.compile(r'<ymax>([0-9]+)</ymax>')
-                with open(xml_path, 'r') as inxml, open(new_file_path, 'w') as outxml:
-                    for buf in inxml:
-                        v = None
-                        if '<width>' in buf:
-                            v = re_width.search(buf).group(1)
-                            buf = buf.replace(v, str(img.shape[1]))
-                        elif '<height>' in buf:
-                            v = re_height.search(buf).group(1)
-                            buf = buf.replace(v, str(img.shape[0]))
-                        elif 'xmin' in buf:
-                            v = re_xmin.search(buf).group(1)
-                            buf = buf.replace(v, str(int(int(v) * resize_ratio + shift_w)))
-                        elif 'xmax' in buf:
-                            v = re_xmax.search(buf).group(1)
-                            buf = buf.replace(v, str(int(int(v) * resize_ratio + shift_w)))
-                        elif 'ymin' in buf:
-                            v = re_ymin.search(buf).group(1)
-                            buf = buf.replace(v, str(int(int(v) * resize_ratio + shift_h)))
-                        elif 'ymax' in buf:
-                            v = re_ymax.search(buf).group(1)
-                            buf = buf.replace(v, str(int(int(v) * resize_ratio + shift_h)))
-                    
-                        outxml.write(buf)
-                     
-        
-               
-        image_files = []
-        if os.path.isfile(input_path):
-            image_files = [input_path]
-        elif os.path.isdir(input_path):
-            print(input_path)
-            for f in os.listdir(input_path):
-                if os.path.splitext(f)[1] in self.image_extension:
-                    image_files.append(os.path.join(input_path, f))
-        
-        r = joblib.Parallel(n_jobs=n_jobs, verbose=0)([joblib.delayed(__resize)(image_file, size,
-                        output_dirpath, output_prefix) for image_file in image_files])
+                return resize_ratio, resized_shape, img.shape
+            
+            
+            def __resize_fast(img_path, size, output_dirpath, output_prefix):
+                # reduced decoding of JPEG images, if the original image size is found in the header.
+                # EXIF orientation is ignored, the header size and the annotations are of the stored pixels
+                reduced_flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+                reduced_flags = {k: v | cv2.IMREAD_IGNORE_ORIENTATION for k, v in reduced_flags.items()}
+                reduction = 1
+                try:
+                    original_shape = _image_size(img_path)
+                except (OSError, struct.error):
+                    original_shape = None
+                if original_shape is not None and os.path.splitext(img_path)[1].lower() in ['.jpg', '.jpeg']:
+                    h, w = original_shape
+                    resize_ratio = size[1] / h if max(h, w) == h else size[0] / w
+                    reduction = max([1] + [k for k in [2, 4, 8] if k * resize_ratio <= 1])
+                img_original = cv2.imread(img_path, reduced_flags[reduction])
+                if original_shape is None:
+                    original_shape = img_original.shape[:2]
+                h, w = original_shape
+                
+                resize_ratio = None
+                if max(h, w) == h:
+                    resize_ratio = size[1] / h
+                else:
+                    resize_ratio = size[0] / w
+                
+                # resize the original image to target size
+                img = cv2.resize(img_original, (int(round(w * resize_ratio)), int(round(h * resize_ratio))),
+                                 interpolation=cv2.INTER_AREA if resize_ratio * reduction < 1 else cv2.INTER_LINEAR)
+                if img.ndim == 2:
+                    img = img[:, :, np.newaxis]
+                
+                # make background from the resized image, scaled as the 1.5 times original image
+                block_size = img.shape[0] if img.shape[0] > img.shape[1] else img.shape[1]
+                bg_img = self.__augmentation_generate_background(img, block_size, scale=1.5 / resize_ratio)
+                bg_img = (bg_img * 255).astype(np.uint8)
+                
+                # synthesis
+                resized_shape = img.shape
+                img = self.__get_padding(img).reshape(block_size, block_size, -1)
+                mask = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.shape[2] == 3 else img[:, :, 0]
+                mask = cv2.copyMakeBorder(cv2.resize(mask, (block_size - 2, block_size - 2), interpolation=cv2.INTER_LINEAR),
+                                          1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+                img[mask == 0] = bg_img.reshape(img.shape)[mask == 0]
+                
+                # print out resized image
+                new_file_path = os.path.join(output_dirpath, output_prefix + '_' + os.path.basename(img_path))
+                writer.write(new_file_path, img, channel_order='BGR')
+                
+                return resize_ratio, resized_shape, img.shape
+            
+            
+            def __resize_image(img_path, size, output_dirpath, output_prefix):
+                _resize = __resize_fast if fast else __resize
+                resize_ratio, resized_shape, img_shape = _resize(img_path, size, output_dirpath, output_prefix)
+                
+                # print out xml, if given
+                xml_path = os.path.splitext(img_path)[0] + '.xml'
+                if os.path.exists(xml_path):
+                    # shift by the padding
+                    shift_h = (img_shape[0] - resized_shape[0]) // 2
+                    shift_w = (img_shape[1] - resized_shape[1]) // 2
+                    new_file_path = os.path.join(output_dirpath, output_prefix + '_' + os.path.basename(xml_path))
+                    self.__transform_PascalVOC(xml_path, new_file_path, resize_ratio, shift_w, shift_h, img_shape)
+                writer.flush()
+            
+                   
+            image_files = []
+            if isinstance(input_path, Manifest):
+                image_files = input_path.file_paths(extensions=self.image_extension)
+            elif os.path.isfile(input_path):
+                image_files = [input_path]
+            elif os.path.isdir(input_path):
+                for f in os.listdir(input_path):
+                    if os.path.splitext(f)[1] in self.image_extension:
+                        image_files.append(os.path.join(input_path, f))
+            
+            r = joblib.Parallel(n_jobs=n_jobs, verbose=0)([joblib.delayed(__resize_image)(image_file, size,
+                            output_dirpath, output_prefix) for image_file in image_files])
             
             
 
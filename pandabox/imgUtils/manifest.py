@@ -0,0 +1,275 @@
+import os
+import sys
+import struct
+import concurrent.futures
+import numpy as np
+
+
+# extensions of image files, shared with imgUtils and nnUtils, matched case-insensitively
+_IMAGE_EXTENSIONS = ['.jpeg', '.jpg', '.png', '.tif', '.tiff']
+
+
+
+def _tiff_size(infh, byteorder):
+    # height and width of the first IFD of TIFF or BigTIFF image
+    version = struct.unpack(byteorder + 'H', infh.read(2))[0]
+    if version == 42:
+        ifd_offset = struct.unpack(byteorder + 'I', infh.read(4))[0]
+        count_fmt, entry_fmt, entry_size = 'H', 'HHI4s', 12
+    elif version == 43:
+        infh.read(4)
+        ifd_offset = struct.unpack(byteorder + 'Q', infh.read(8))[0]
+        count_fmt, entry_fmt, entry_size = 'Q', 'HHQ8s', 20
+    else:
+        return None
+
+    infh.seek(ifd_offset)
+    n_entries = struct.unpack(byteorder + count_fmt, infh.read(struct.calcsize(count_fmt)))[0]
+    buff = infh.read(n_entries * entry_size)
+    size = {}
+    for i in range(n_entries):
+        tag, value_type, _, value = struct.unpack(byteorder + entry_fmt, buff[(i * entry_size):((i + 1) * entry_size)])
+        if tag in [256, 257]:
+            # SHORT, LONG, or LONG8
+            fmt = {3: 'H', 4: 'I', 16: 'Q'}.get(value_type)
+            if fmt is None:
+                return None
+            size[tag] = struct.unpack(byteorder + fmt, value[:struct.calcsize(fmt)])[0]
+    if 256 not in size or 257 not in size:
+        return None
+    return size[257], size[256]
+
+
+
+def _image_size(file_path):
+    # height and width of PNG, JPEG, or TIFF image from the header, None for the other formats
+    with open(file_path, 'rb') as infh:
+        buff = infh.read(26)
+        if buff[:8] == b'\x89PNG\r\n\x1a\n' and buff[12:16] == b'IHDR':
+            return struct.unpack('>I', buff[20:24])[0], struct.unpack('>I', buff[16:20])[0]
+        if buff[:2] in [b'II', b'MM']:
+            infh.seek(2)
+            return _tiff_size(infh, '<' if buff[:2] == b'II' else '>')
+        if buff[:2] != b'\xff\xd8':
+            return None
+
+        # JPEG, find the SOF marker
+        infh.seek(2)
+        while True:
+            marker = infh.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None
+            if marker[1] == 0xff:
+                infh.seek(-1, 1)
+                continue
+            if 0xd0 <= marker[1] <= 0xd9 or marker[1] == 0x01:
+                continue
+            segment_length = struct.unpack('>H', infh.read(2))[0]
+            if 0xc0 <= marker[1] <= 0xcf and marker[1] not in [0xc4, 0xc8, 0xcc]:
+                h, w = struct.unpack('>HH', infh.read(5)[1:])
+                return h, w
+            infh.seek(segment_length - 2, 1)
+
+
+
+def _scan_dir(dirpath, extensions):
+    # path, size, and mtime of image files under the directory
+    files = []
+    dirpaths = [dirpath]
+    while len(dirpaths) > 0:
+        with os.scandir(dirpaths.pop()) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    dirpaths.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in extensions:
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+    return files
+
+
+
+class Manifest:
+    '''
+    Manifest of image datasets.
+
+    The manifest records path, class label (the name of the sub-directory
+    under the root directory), file size, modification time, and image size
+    (read from PNG, JPEG, or TIFF headers without decoding) of all images
+    under a directory. Sub-directories are scanned in parallel with
+    `os.scandir`. The manifest is saved to a compressed npz file, and the
+    later scans read the image size again only for new or modified files.
+    The manifest can be given to `imgUtils` and `nnBase` methods instead
+    of directories.
+
+    Examples:
+        >>> manifest = Manifest().scan('dataset', manifest_path='dataset.manifest.npz')
+        >>> manifest.classes
+        ['class_1', 'class_2']
+        >>> manifest.file_paths('class_1')
+    '''
+
+    def __init__(self, manifest_path=None):
+        '''
+        Args:
+            manifest_path (str): A path to a manifest file to load.
+        '''
+
+        self.root = None
+        self.file_path = np.zeros(0, dtype=str)
+        self.class_label = np.zeros(0, dtype=str)
+        self.size = np.zeros(0, dtype=np.int64)
+        self.mtime = np.zeros(0, dtype=np.float64)
+        self.height = np.zeros(0, dtype=np.int64)
+        self.width = np.zeros(0, dtype=np.int64)
+        self.extensions = list(_IMAGE_EXTENSIONS)
+
+        if manifest_path is not None:
+            self.load(manifest_path)
+
+
+
+    def __len__(self):
+        return len(self.file_path)
+
+
+
+    @property
+    def classes(self):
+        '''Class labels, the names of sub-directories which contain images.'''
+        return sorted(set(self.class_label.tolist()) - {''})
+
+
+
+    def scan(self, root, manifest_path=None, n_jobs=-1):
+        '''Scan images under the directory.
+
+        Args:
+            root (str): A path to the root directory of datasets.
+            manifest_path (str): A path to a manifest file. If the file exists, the
+                                 manifest is updated incrementally, and saved after the scan.
+            n_jobs (int): The number of threads to scan directories and read headers.
+
+        Returns:
+            Manifest: The manifest itself.
+        '''
+
+        if not os.path.isdir(root):
+            raise ValueError('`scan` method requires a directory for `root` argument.')
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = max(1, (os.cpu_count() or 1) * 4)
+
+        previous = {}
+        if manifest_path is not None and os.path.exists(manifest_path):
+            self.load(manifest_path)
+            if self.root == os.path.abspath(root):
+                previous = {f: i for i, f in enumerate(self.file_path.tolist())}
+        _previous = (self.size, self.mtime, self.height, self.width)
+        root = os.path.abspath(root)
+        extensions = set(self.extensions)
+
+        # scan files on the root, and the sub-directories in parallel
+        files = []
+        subdirpaths = []
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    subdirpaths.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in extensions:
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            for _files in pool.map(lambda d: _scan_dir(d, extensions), subdirpaths):
+                files.extend(_files)
+        files.sort()
+
+        file_path = [os.path.relpath(f[0], root) for f in files]
+        size = np.array([f[1] for f in files], dtype=np.int64)
+        mtime = np.array([f[2] for f in files], dtype=np.float64)
+        height = np.full(len(files), -1, dtype=np.int64)
+        width = np.full(len(files), -1, dtype=np.int64)
+
+        # image size of new or modified files
+        updated = []
+        for i, f in enumerate(file_path):
+            j = previous.get(f)
+            if j is not None and _previous[0][j] == size[i] and _previous[1][j] == mtime[i]:
+                height[i], width[i] = _previous[2][j], _previous[3][j]
+            else:
+                updated.append(i)
+
+        def __image_size(i):
+            try:
+                return _image_size(files[i][0])
+            except (OSError, struct.error):
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            for i, image_size in zip(updated, pool.map(__image_size, updated)):
+                if image_size is not None:
+                    height[i], width[i] = image_size
+
+        self.root = root
+        self.file_path = np.array(file_path, dtype=str)
+        self.class_label = np.array([f.split(os.sep)[0] if os.sep in f else '' for f in file_path], dtype=str)
+        self.size = size
+        self.mtime = mtime
+        self.height = height
+        self.width = width
+
+        if manifest_path is not None:
+            self.save(manifest_path)
+
+        return self
+
+
+
+    def file_paths(self, class_label=None, extensions=None):
+        '''Return paths to images.
+
+        Args:
+            class_label (str): Return only images of the class.
+            extensions (list): Return only images with the extensions, e.g., ['.jpg', '.png'].
+
+        Returns:
+            list: Paths to images.
+        '''
+
+        is_target = np.ones(len(self.file_path), dtype=bool)
+        if class_label is not None:
+            is_target &= (self.class_label == class_label)
+        if extensions is not None:
+            extensions = set(extensions)
+            is_target &= np.array([os.path.splitext(f)[1] in extensions for f in self.file_path.tolist()], dtype=bool)
+        return [os.path.join(self.root, f) for f in self.file_path[is_target].tolist()]
+
+
+
+    def save(self, manifest_path):
+        '''Save the manifest to a compressed npz file.'''
+
+        with open(manifest_path, 'wb') as outfh:
+            np.savez_compressed(outfh, root=np.array(self.root, dtype=str),
+                                file_path=self.file_path, size=self.size, mtime=self.mtime,
+                                height=self.height, width=self.width)
+
+
+
+    def load(self, manifest_path):
+        '''Load the manifest saved with `save`.'''
+
+        with np.load(manifest_path) as data:
+            self.root = str(data['root'])
+            self.file_path = data['file_path']
+            self.size = data['size']
+            self.mtime = data['mtime']
+            self.height = data['height']
+            self.width = data['width']
+        self.class_label = np.array([f.split(os.sep)[0] if os.sep in f else '' for f in self.file_path.tolist()], dtype=str)
+
+        return self
+
+
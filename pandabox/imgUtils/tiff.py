@@ -0,0 +1,165 @@
+import os
+import sys
+import threading
+import collections
+import numpy as np
+
+
+
+class TiledImage:
+    '''
+    Read regions of large TIFF/BigTIFF images without loading the whole image.
+
+    Uncompressed contiguous images are memory-mapped. For tiled (or stripped)
+    images, only the tiles which a region touches are read and decoded, and
+    the decoded tiles are kept in a LRU cache, so that tiles shared by the
+    neighboring regions are decoded once. Regions are read with slices as
+    numpy arrays, e.g., `img[ymin:ymax, xmin:xmax]`, and reading is thread-safe.
+    The first page (the highest resolution) is used. `tifffile` is required.
+
+    Examples:
+        >>> img = TiledImage('orthomosaic.tif', cache_size=256)
+        >>> img.shape
+        (50000, 50000, 3)
+        >>> region = img[1000:1500, 2000:2400]
+    '''
+
+    def __init__(self, file_path, cache_size=64):
+        '''
+        Args:
+            file_path (str): A path to TIFF image.
+            cache_size (int): The maximum number of decoded tiles kept in the cache.
+        '''
+
+        import tifffile
+
+        self.file_path = file_path
+        self.cache_size = cache_size
+        self.__cache = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__memmap = None
+        self.__array = None
+
+        self.__tif = tifffile.TiffFile(file_path)
+        self.__page = self.__tif.pages[0]
+        self.shape = tuple(self.__page.shape)
+        self.dtype = self.__page.dtype
+        if len(self.shape) == 2:
+            self.shape = self.shape + (1, )
+        self.ndim = 3
+
+        if self.__page.is_memmappable:
+            self.__memmap = tifffile.memmap(file_path, page=0, mode='r').reshape(self.shape)
+        elif self.__page.planarconfig != 1 or len(self.__page.shape) > 3:
+            # planes are saved separately, read the whole image
+            self.__array = self.__page.asarray().reshape(self.shape)
+        else:
+            if self.__page.is_tiled:
+                self.tile_shape = (self.__page.tilelength, self.__page.tilewidth)
+            else:
+                self.tile_shape = (min(self.__page.rowsperstrip, self.shape[0]), self.shape[1])
+            self.n_tiles = (int(np.ceil(self.shape[0] / self.tile_shape[0])),
+                            int(np.ceil(self.shape[1] / self.tile_shape[1])))
+            self.__fd = os.open(file_path, os.O_RDONLY)
+
+
+
+    def __del__(self):
+        self.close()
+
+
+
+    def close(self):
+        '''Close the file.'''
+
+        if getattr(self, '_TiledImage__fd', None) is not None:
+            os.close(self.__fd)
+            self.__fd = None
+        if getattr(self, '_TiledImage__tif', None) is not None:
+            self.__tif.close()
+            self.__tif = None
+
+
+
+    @property
+    def is_tiled(self):
+        '''`True` if regions are read by tiles, `False` if memory-mapped or loaded.'''
+        return self.__memmap is None and self.__array is None
+
+
+
+    def tile_index(self, y, x):
+        '''Return the tile index (row, column) which contains the pixel (y, x).'''
+
+        if not self.is_tiled:
+            return (0, 0)
+        return (int(y // self.tile_shape[0]), int(x // self.tile_shape[1]))
+
+
+
+    def __tile(self, ty, tx):
+        # decoded tile, cached
+        key = (ty, tx)
+        with self.__lock:
+            if key in self.__cache:
+                self.__cache.move_to_end(key)
+                return self.__cache[key]
+
+        i = ty * self.n_tiles[1] + tx
+        data = os.pread(self.__fd, self.__page.databytecounts[i], self.__page.dataoffsets[i])
+        tile = self.__page.decode(data, i, jpegtables=self.__page.jpegtables)[0]
+        tile = tile.reshape(tile.shape[-3:])
+        tile = tile[:min(self.tile_shape[0], self.shape[0] - ty * self.tile_shape[0]),
+                    :min(self.tile_shape[1], self.shape[1] - tx * self.tile_shape[1])]
+
+        with self.__lock:
+            self.__cache[key] = tile
+            self.__cache.move_to_end(key)
+            while len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+        return tile
+
+
+
+    def read(self, ymin, ymax, xmin, xmax):
+        '''Read the region [ymin, ymax) x [xmin, xmax), clipped by the image.
+
+        Returns:
+            numpy.ndarray: The region (height x width x channels).
+        '''
+
+        ymin, ymax = max(0, ymin), min(self.shape[0], ymax)
+        xmin, xmax = max(0, xmin), min(self.shape[1], xmax)
+        ymax, xmax = max(ymin, ymax), max(xmin, xmax)
+        if self.__memmap is not None:
+            return np.array(self.__memmap[ymin:ymax, xmin:xmax])
+        if self.__array is not None:
+            return self.__array[ymin:ymax, xmin:xmax]
+
+        region = np.empty((ymax - ymin, xmax - xmin, self.shape[2]), dtype=self.dtype)
+        if region.size == 0:
+            return region
+        th, tw = self.tile_shape
+        for ty in range(ymin // th, (ymax - 1) // th + 1):
+            for tx in range(xmin // tw, (xmax - 1) // tw + 1):
+                tile = self.__tile(ty, tx)
+                y0, x0 = max(ymin, ty * th), max(xmin, tx * tw)
+                y1, x1 = min(ymax, ty * th + tile.shape[0]), min(xmax, tx * tw + tile.shape[1])
+                region[(y0 - ymin):(y1 - ymin), (x0 - xmin):(x1 - xmin)] = tile[(y0 - ty * th):(y1 - ty * th),
+                                                                                (x0 - tx * tw):(x1 - tx * tw)]
+        return region
+
+
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        key = key + (slice(None), ) * (3 - len(key))
+        for k in key[:2]:
+            if not isinstance(k, slice) or k.step not in [None, 1]:
+                raise ValueError('`TiledImage` supports only slices with step 1 for rows and columns.')
+        ymin, ymax, _ = key[0].indices(self.shape[0])
+        xmin, xmax, _ = key[1].indices(self.shape[1])
+        return self.read(ymin, ymax, xmin, xmax)[:, :, key[2]]
+
+
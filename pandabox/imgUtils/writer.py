@@ -0,0 +1,203 @@
+import os
+import sys
+import threading
+import concurrent.futures
+import numpy as np
+import cv2
+
+
+
+class ImageWriter:
+    '''
+    Encode and write images on a bounded thread pool.
+
+    Images are encoded and written by background threads, so that encoding
+    overlaps with the computation of the next images. The number of pending
+    images is bounded by `max_pending`, and `write` blocks if it is reached.
+    Directories are created once and remembered. The writer keeps only its
+    configuration when it is pickled, therefore it can be passed to joblib
+    workers, and each worker starts its own threads.
+
+    Examples:
+        >>> writer = ImageWriter(file_format='jpeg', jpeg_quality=90)
+        >>> writer.write('output/image_1.png', img)   # saved as output/image_1.jpg
+        >>> writer.close()
+    '''
+
+    def __init__(self, file_format=None, png_compression=3, jpeg_quality=95, webp_quality=95,
+                 n_threads=4, max_pending=None):
+        '''
+        Args:
+            file_format (str): `png`, `jpeg`, `webp`, or `npy` (raw arrays).
+                               If `None`, the format is decided by the extension of each file.
+            png_compression (int): Compression level of PNG (0-9).
+            jpeg_quality (int): Quality of JPEG (0-100).
+            webp_quality (int): Quality of WebP (1-100, >100 for lossless).
+            n_threads (int): The number of threads to encode and write images.
+            max_pending (int): The maximum number of images waiting to be written,
+                               `4 * n_threads` by default.
+        '''
+
+        if file_format is not None and file_format not in ['png', 'jpeg', 'webp', 'npy']:
+            raise ValueError('Only `png`, `jpeg`, `webp`, or `npy` can be set in `file_format` argument.')
+
+        self.file_format = file_format
+        self.png_compression = png_compression
+        self.jpeg_quality = jpeg_quality
+        self.webp_quality = webp_quality
+        self.n_threads = n_threads
+        self.max_pending = max_pending if max_pending is not None else 4 * n_threads
+        self.__init_state()
+
+
+
+    def __init_state(self):
+        self.__pool = None
+        self.__futures = []
+        self.__lock = threading.Lock()
+        self.__slots = threading.BoundedSemaphore(self.max_pending)
+        self.__dirpaths = set()
+
+
+
+    def __getstate__(self):
+        return {'file_format': self.file_format, 'png_compression': self.png_compression,
+                'jpeg_quality': self.jpeg_quality, 'webp_quality': self.webp_quality,
+                'n_threads': self.n_threads, 'max_pending': self.max_pending}
+
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__init_state()
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+
+    def makedirs(self, dirpaths):
+        '''Create directories at once.
+
+        Args:
+            dirpaths (list): Paths to directories.
+        '''
+
+        for dirpath in set(dirpaths) - self.__dirpaths:
+            if dirpath != '':
+                os.makedirs(dirpath, exist_ok=True)
+            self.__dirpaths.add(dirpath)
+
+
+
+    def file_path(self, file_path):
+        '''Return the path where the image is written, whose extension is replaced by the format.'''
+
+        extensions = {'png': '.png', 'jpeg': '.jpg', 'webp': '.webp', 'npy': '.npy'}
+        if self.file_format is None:
+            return file_path
+        return os.path.splitext(file_path)[0] + extensions[self.file_format]
+
+
+
+    def __encode(self, file_path, img, channel_order):
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext == '.npy':
+            np.save(file_path, img)
+            return
+
+        # floating images are in [0, 1], other integer images are cast if the values fit in uint8
+        if np.issubdtype(img.dtype, np.floating) or img.dtype == np.bool_:
+            img = (np.clip(img, 0, 1) * 255).astype(np.uint8)
+        elif img.dtype != np.uint8 and img.dtype != np.uint16:
+            if not np.issubdtype(img.dtype, np.integer):
+                raise ValueError('Unsupported image dtype `' + str(img.dtype) + '`: ' + file_path + '.')
+            if img.min() < 0 or img.max() > 255:
+                raise ValueError('Values of `' + str(img.dtype) + '` image are out of the range of uint8: ' + file_path + '.')
+            img = img.astype(np.uint8)
+        if img.dtype == np.uint16 and ext not in ['.png', '.tif', '.tiff']:
+            img = (img // 257).astype(np.uint8)
+        if channel_order == 'RGB' and img.ndim == 3 and img.shape[2] in [3, 4]:
+            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR if img.shape[2] == 3 else cv2.COLOR_RGBA2BGRA)
+
+        params = []
+        if ext == '.png':
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        elif ext in ['.jpg', '.jpeg']:
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        elif ext == '.webp':
+            params = [cv2.IMWRITE_WEBP_QUALITY, self.webp_quality]
+        is_success, buff = cv2.imencode(ext, img, params)
+        if not is_success:
+            raise ValueError('Failed to encode image: ' + file_path + '.')
+        with open(file_path, 'wb') as outfh:
+            outfh.write(buff.tobytes())
+
+
+
+    def __write(self, file_path, img, channel_order):
+        try:
+            self.__encode(file_path, img, channel_order)
+        finally:
+            self.__slots.release()
+
+
+
+    def write(self, file_path, img, channel_order='RGB'):
+        '''Write an image in background.
+
+        Args:
+            file_path (str): A path to the output file, the extension is
+                             replaced if `file_format` is given.
+            img (numpy.ndarray): An image, uint8 (or uint16 for PNG and TIFF),
+                                 or float in [0, 1] which is converted to uint8.
+            channel_order (str): `RGB` (skimage) or `BGR` (OpenCV).
+
+        Returns:
+            str: The path to the output file.
+        '''
+
+        file_path = self.file_path(file_path)
+        dirpath = os.path.dirname(file_path)
+        if dirpath not in self.__dirpaths:
+            self.makedirs([dirpath])
+
+        self.__slots.acquire()
+        with self.__lock:
+            if self.__pool is None:
+                self.__pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.n_threads)
+            self.__futures = [f for f in self.__futures if not f.done() or f.exception() is not None]
+            self.__futures.append(self.__pool.submit(self.__write, file_path, img, channel_order))
+
+        return file_path
+
+
+
+    def flush(self):
+        '''Wait until all pending images are written, and raise the error if failed.'''
+
+        with self.__lock:
+            futures = self.__futures
+            self.__futures = []
+        for f in futures:
+            f.result()
+
+
+
+    def close(self):
+        '''Write all pending images and stop the threads.'''
+
+        self.flush()
+        with self.__lock:
+            if self.__pool is not None:
+                self.__pool.shutdown()
+                self.__pool = None
+
+
@@ -1,10 +1,13 @@
 import os
+import threading
+import concurrent.futures
 import glob
 import pickle
 import numpy as np
 import skimage
 import skimage.io
 import cv2
+from ..imgUtils.manifest import Manifest, _IMAGE_EXTENSIONS
 import torch
 
 
@@ -73,7 +76,29 @@ class nnTorchDataset(torch.utils.data.Dataset):
 
 class nnBatchGenerator(keras.utils.Sequence):
 
-    def __init__(self, data, image_shape, batch_size=64):
+    def __init__(self, data, image_shape, batch_size=64, n_threads=4, prefetch=2, shuffle=False, random_state=None):
+        '''
+        Images of a batch are decoded and preprocessed by a thread pool, and
+        written into a float32 batch array allocated for the batch, which is
+        owned by the caller once returned. While a batch is used, the next
+        `prefetch` batches are loaded in background, once the access order of
+        batches is found to be sequential or strided (e.g. 0, 1, 2, ... or
+        1, 5, 9, ...). Prefetched batches requested out of order, e.g. by the
+        threads of the Keras enqueuer, keep the access order. Random access
+        is served without prefetching. To shuffle samples, use `shuffle=True`
+        of the generator, which shuffles samples at the end of each epoch and
+        keeps the batch order sequential, instead of `shuffle` of Keras, which
+        shuffles the order of batches.
+
+        Args:
+            data (list): A list of image paths and labels.
+            image_shape (list): Width, height, and channels of images.
+            batch_size (int): The number of images in a batch.
+            n_threads (int): The number of threads to decode images.
+            prefetch (int): The number of batches loaded in advance.
+            shuffle (bool): Shuffle samples at the end of each epoch.
+            random_state (int): A seed of random numbers to shuffle samples.
+        '''
 
         self.x = data[0]
         self.y = data[1]
@@ -83,6 +108,73 @@ class nnBatchGenerator(keras.utils.Sequence):
         self.image_shape = image_shape
         self.batches_per_epoch = int((self.length - 1) / batch_size) + 1
 
+        self.n_threads = n_threads
+        self.prefetch = prefetch
+        self.shuffle = shuffle
+        self.random_state = np.random.RandomState(random_state)
+        self.order = np.arange(self.length)
+        if self.shuffle:
+            self.random_state.shuffle(self.order)
+        self.__init_loader()
+
+
+
+    def __init_loader(self):
+        self.__pool = None
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__last_idx = None
+        self.__last_prefetched = None
+        self.__stride = 1
+
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in list(state.keys()):
+            if k.startswith('_nnBatchGenerator__'):
+                state.pop(k)
+        return state
+
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('n_threads', 4)
+        self.__dict__.setdefault('prefetch', 2)
+        self.__dict__.setdefault('shuffle', False)
+        self.__dict__.setdefault('random_state', np.random.RandomState())
+        self.__dict__.setdefault('order', np.arange(self.length))
+        self.__init_loader()
+
+
+
+    def __load_image(self, image_path, x_batch, k):
+        _x = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        _x = self.preprocess(_x)
+        np.multiply(_x, 1 / 255.0, out=x_batch[k], casting='unsafe')
+
+
+
+    def __submit(self, idx):
+        # start loading the batch into a new batch array, if it is not being loaded
+        if idx < 0 or idx >= self.batches_per_epoch or idx in self.__pending:
+            return
+        if self.__pool is None:
+            self.__pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.n_threads)
+
+        sample_ids = self.order[(self.batch_size * idx):(self.batch_size * (idx + 1))]
+        x_batch = np.empty((len(sample_ids), self.image_shape[1], self.image_shape[0], 3), dtype=np.float32)
+        futures = [self.__pool.submit(self.__load_image, self.x[i], x_batch, k)
+                   for k, i in enumerate(sample_ids)]
+        self.__pending[idx] = (x_batch, futures)
+
+
+
+    def __cancel(self, idx):
+        for f in self.__pending.pop(idx)[1]:
+            f.cancel()
+
 
 
     def __getitem__(self, idx):
@@ -93,18 +185,38 @@ class nnBatchGenerator(keras.utils.Sequence):
         if batch_to > self.length:
             batch_to = self.length
 
-        x_batch = []
-        y_batch = []
-        for i in range(batch_from, batch_to):
-            _x = cv2.imread(self.x[i], cv2.IMREAD_COLOR)
-            _x = self.preprocess(_x)
-            x_batch.append(_x)
-            y_batch.append(self.y[i])
-
-        x_batch = np.asarray(x_batch)
-        x_batch = x_batch.astype('float32') / 255.0
-
-        y_batch = np.asarray(y_batch)
+        with self.__lock:
+            # prefetch only if the batch follows the access order, i.e., the same stride as the last access,
+            # or the batch has been prefetched, which concurrent consumers may request out of order
+            if self.__last_idx is not None and idx in self.__pending:
+                is_ordered = True
+            else:
+                if self.__last_idx is None:
+                    is_ordered = (idx == 0)
+                else:
+                    is_ordered = (idx - self.__last_idx == self.__stride)
+                    if idx != self.__last_idx:
+                        self.__stride = idx - self.__last_idx
+                for _idx in list(self.__pending.keys()):
+                    if _idx != idx:
+                        self.__cancel(_idx)
+                self.__last_prefetched = idx
+            self.__last_idx = idx
+
+            # submit batches beyond the last prefetched one, the others are pending or already returned
+            self.__submit(idx)
+            if is_ordered:
+                for k in range(1, self.prefetch + 1):
+                    _idx = idx + self.__stride * k
+                    if (_idx - self.__last_prefetched) * self.__stride > 0:
+                        self.__submit(_idx)
+                        self.__last_prefetched = _idx
+            x_batch, futures = self.__pending.pop(idx)
+
+        for f in futures:
+            f.result()
+
+        y_batch = np.asarray(self.y)[self.order[batch_from:batch_to]]
 
         return x_batch, y_batch
 
@@ -148,7 +260,14 @@ class nnBatchGenerator(keras.utils.Sequence):
 
 
     def on_epoch_end(self):
-        pass
+        with self.__lock:
+            for idx in list(self.__pending.keys()):
+                self.__cancel(idx)
+            self.__last_idx = None
+            self.__last_prefetched = None
+            self.__stride = 1
+            if self.shuffle:
+                self.random_state.shuffle(self.order)
 
 
 
@@ -184,8 +303,7 @@ class nnBase:
 
             self.model = None
 
-            self.image_extension = ['jpeg', 'jpg', 'png', 'tif', 'tiff',
-                                    'JPEG', 'JPG', 'PNG', 'TIF', 'TIFF']
+            self.image_extension = [ext[1:] for ext in _IMAGE_EXTENSIONS] + [ext[1:].upper() for ext in _IMAGE_EXTENSIONS]
             self.debug = debug
 
         else:
@@ -217,6 +335,19 @@ class nnBase:
         x = []
         y = []
 
+        # load data from the manifest
+        if isinstance(data_path, Manifest):
+            if class_label is None:
+                class_label = data_path.classes
+            extensions = ['.' + ext for ext in self.image_extension]
+            for _i, _d in enumerate(class_label):
+                _x = data_path.file_paths(_d, extensions)
+                x.extend(_x)
+                y.extend([_i] * len(_x))
+            x = np.asarray(x)
+            y = keras.utils.np_utils.to_categorical(np.asarray(y), num_classes=len(class_label))
+            return [x, y, class_label]
+
         # if class_label is not given, then create it according to the directory names
         if class_label is None:
             class_label = sorted(os.listdir(data_path))
@@ -250,6 +381,9 @@ class nnBase:
         
         x = []
         
+        if isinstance(data_path, Manifest):
+            return np.asarray(data_path.file_paths(extensions=['.' + ext for ext in self.image_extension]))
+        
         for ext in self.image_extension:
             for _f in glob.glob(os.path.join(data_path, '*' + ext)):
                 x.append(_f)
@@ -276,7 +410,7 @@ class nnBase:
 
         # load training data set
         if dataset == 'train':
-            if not os.path.exists(data_path):
+            if not isinstance(data_path, Manifest) and not os.path.exists(data_path):
                 raise ValueError('`load_data` method could not find train data set, set train data set in a `train` directory in ' + data_path)
             
             x, y, class_label = self.__load_data(data_path, None)
@@ -286,7 +420,7 @@ class nnBase:
         
         # load data for prediction
         if dataset == 'predict':
-            if not os.path.exists(data_path):
+            if not isinstance(data_path, Manifest) and not os.path.exists(data_path):
                 raise ValueError('`predict` method could not find data set for prediction, check the directory and put the data into the directory in ' + data_path)
             x = self.__load_data_predict(data_path)
             self.predict_data = [x, None]
@@ -2,7 +2,10 @@ from .seq import Seq
 from .fastx import FASTX
 from .gtf import GTF
 from .vcf import VCF
-from .log import LogFile
+from .log import LogFile, StarProgressWatcher
+from .featurecounts import FeatureCounts
 
 
 
+from .genotype import PackedGenotype
+from .annotate import VariantAnnotator
@@ -0,0 +1,187 @@
+import os
+import sys
+import numpy as np
+
+
+
+class VariantAnnotator:
+    '''
+    Join variants and features (genes, exons, etc.) by coordinates.
+
+    Features are sorted by start positions for each chromosome, and variants
+    sorted by positions are joined with them by a merge-sweep, which keeps only
+    the features overlapping the current variant. Each variant is joined with
+    the indexes of the overlapped features, or the nearest feature and the
+    distance to it for intergenic variants. Coordinates are 1-based and both
+    ends are inclusive.
+    '''
+
+    def __init__(self, features):
+        '''
+        Args:
+            features (dict): Output of `GTF.parse_gtf`, or a dictionary whose keys
+                             are chromosome names and values are dictionaries of
+                             `start` and `end` arrays.
+        '''
+
+        self.features = {}
+        for chr_name, ranges in features.items():
+            if isinstance(ranges, dict):
+                starts = np.asarray(ranges['start'], dtype=np.int64)
+                ends = np.asarray(ranges['end'], dtype=np.int64)
+            else:
+                # [start, end] (output_fmt=2) or [id, start, end, ...] (output_fmt=3 or 4)
+                k = 0 if len(ranges) == 0 or len(ranges[0]) == 2 else 1
+                starts = np.array([r[k] for r in ranges], dtype=np.int64)
+                ends = np.array([r[k + 1] for r in ranges], dtype=np.int64)
+            o = np.argsort(starts, kind='stable')
+            self.features[chr_name] = {'start': starts[o], 'end': ends[o], 'index': o}
+
+
+
+    def __sweep(self, chr_name, spans):
+        # join sorted variant spans [start, end] with features on the chromosome,
+        # and yield overlapped feature indexes, the nearest feature, and the distance
+        if chr_name not in self.features:
+            for _ in spans:
+                yield [], -1, -1
+            return
+
+        f_starts = self.features[chr_name]['start']
+        f_ends = self.features[chr_name]['end']
+        f_index = self.features[chr_name]['index']
+        _f_starts = f_starts.tolist()
+        _f_ends = f_ends.tolist()
+        n_features = len(_f_starts)
+
+        k = 0
+        active = []
+        upstream = -1
+        upstream_end = None
+
+        for v_start, v_end in spans:
+
+            # add features starting before the end of variant
+            while k < n_features and _f_starts[k] <= v_end:
+                active.append(k)
+                k += 1
+
+            # remove features ending before the start of variant,
+            # the variants are sorted, therefore they never overlap the following variants
+            if any(_f_ends[f] < v_start for f in active):
+                _active = []
+                for f in active:
+                    if _f_ends[f] < v_start:
+                        if upstream_end is None or upstream_end < _f_ends[f]:
+                            upstream = f
+                            upstream_end = _f_ends[f]
+                    else:
+                        _active.append(f)
+                active = _active
+
+            hits = [int(f_index[f]) for f in active if _f_starts[f] <= v_end]
+            if len(hits) > 0:
+                yield hits, -1, 0
+                continue
+
+            # the nearest feature of intergenic variant
+            downstream = int(np.searchsorted(f_starts, v_end, side='right'))
+            nearest = -1
+            distance = -1
+            if upstream_end is not None:
+                nearest = upstream
+                distance = v_start - upstream_end
+            if downstream < n_features and (nearest < 0 or _f_starts[downstream] - v_end < distance):
+                nearest = downstream
+                distance = _f_starts[downstream] - v_end
+            yield [], (int(f_index[nearest]) if nearest >= 0 else -1), distance
+
+
+
+    def join(self, variants):
+        '''Join variants with features.
+
+        Args:
+            variants (dict): Output of `VCF.parse_vcf` or `VCF.parse_vcf_columns`,
+                             or a dictionary whose keys are chromosome names and
+                             values are arrays of positions.
+
+        Returns:
+            dict: A dictionary whose keys are chromosome names and values are
+                  dictionaries of arrays, `variant_index` and `feature_index`
+                  (pairs of indexes of variants and overlapped features),
+                  `nearest_feature` (index of the nearest feature of intergenic
+                  variants, -1 for the others), and `distance` (distance to the
+                  nearest feature, 0 for the overlapped variants, and -1 if there
+                  is no feature on the chromosome).
+        '''
+
+        alleles = None
+        if 'variants' in variants and 'alleles' in variants:
+            alleles = np.array([len(a) for a in variants['alleles']], dtype=np.int64)
+            variants = variants['variants']
+
+        joined = {}
+        for chr_name, _variants in variants.items():
+            if isinstance(_variants, dict):
+                # columnar variants
+                v_starts = np.asarray(_variants['POS'], dtype=np.int64)
+                v_ends = v_starts + alleles[_variants['REF']] - 1 if alleles is not None else v_starts
+            elif len(_variants) > 0 and isinstance(_variants[0], dict):
+                v_starts = np.array([v['POS'] for v in _variants], dtype=np.int64)
+                v_ends = v_starts + np.array([len(v['REF']) for v in _variants], dtype=np.int64) - 1
+            else:
+                v_starts = np.asarray(_variants, dtype=np.int64)
+                v_ends = v_starts
+
+            o = np.argsort(v_starts, kind='stable')
+            variant_index = []
+            feature_index = []
+            nearest_feature = np.full(len(v_starts), -1, dtype=np.int64)
+            distance = np.full(len(v_starts), -1, dtype=np.int64)
+
+            spans = zip(v_starts[o].tolist(), v_ends[o].tolist())
+            for i, (hits, nearest, dist) in zip(o.tolist(), self.__sweep(chr_name, spans)):
+                variant_index.extend([i] * len(hits))
+                feature_index.extend(hits)
+                nearest_feature[i] = nearest
+                distance[i] = dist
+
+            joined[chr_name] = {'variant_index': np.array(variant_index, dtype=np.int64),
+                                'feature_index': np.array(feature_index, dtype=np.int64),
+                                'nearest_feature': nearest_feature,
+                                'distance': distance}
+
+        return joined
+
+
+
+    def iter_join(self, records):
+        '''Join a stream of variants with features.
+
+        Args:
+            records (iterator): Variant records which contain `CHROM`, `POS`, and
+                                `REF`, e.g., `VCF.iter_vcf`, sorted by positions
+                                within each chromosome.
+
+        Returns:
+            iterator: An iterator of tuples of a record, a list of indexes of the
+                      overlapped features, the index of the nearest feature, and
+                      the distance, the same as `join`.
+        '''
+
+        current = {'record': None}
+
+        def __spans(chr_name, it):
+            # yield spans while the records are on the same chromosome
+            while current['record'] is not None and current['record']['CHROM'] == chr_name:
+                record = current['record']
+                yield record['POS'], record['POS'] + max(len(record['REF']), 1) - 1
+                current['record'] = next(it, None)
+
+        it = iter(records)
+        current['record'] = next(it, None)
+        while current['record'] is not None:
+            chr_name = current['record']['CHROM']
+            for hits, nearest, distance in self.__sweep(chr_name, __spans(chr_name, it)):
+                yield current['record'], hits, nearest, distance
@@ -2,6 +2,7 @@ import os
 import sys
 import re
 import gzip
+import numpy as np
 
 class FASTX:
     
@@ -111,3 +112,228 @@ class FASTX:
     
         infh.close()
     
+    
+    
+    
+    def build_consensus(self, file_path, variants, output=None, line_width=60, genotype=False, chunk_size=1048576):
+        """Apply variants to FASTA sequences.
+        
+        The FASTA file is read line by line, and each sequence is walked
+        together with its sorted variants, so only a few lines of the reference
+        sequence are kept in memory. Output sequences are written in chunks of
+        `chunk_size` bytes. Variants overlapping a previously applied variant,
+        variants whose REF does not match the reference, and symbolic alleles
+        are skipped. Only the first ALT allele is used unless `genotype` is `True`.
+        Sequences are matched with chromosomes of variants by the first word of
+        the FASTA headers. If variants of the iterator are left unapplied, since
+        their chromosomes are not found in the FASTA file or not in the same
+        order, ValueError is raised after the sequences are written.
+        
+        Args:
+            file_path (str): A file path to FASTA file.
+            variants (dict, iterator): Output of `VCF.parse_vcf`, or an iterator of
+                                       records of `VCF.iter_vcf` whose chromosomes
+                                       are in the same order as FASTA file.
+            output (str, bytearray, file): A file path, a bytearray, or a binary
+                                           file object to write the sequences.
+            line_width (int): The number of bases in a line.
+            genotype (bool): If `True`, apply the ALT allele of the GT of the
+                             record, and skip variants with reference genotypes.
+            chunk_size (int): The size of buffer (bytes) to write at once.
+        
+        Returns:
+            dict: A dictionary whose keys are sequence IDs, and values are
+                  dictionaries of `pos` and `offset` arrays. Reference positions
+                  at or after `pos[i]` (and before `pos[i + 1]`) are shifted by
+                  `offset[i]` in the output sequence, see `liftover`.
+        
+        """
+        
+        if output is None:
+            raise ValueError('`build_consensus` method requires `output` argument.')
+        
+        outfh = None
+        if isinstance(output, str):
+            if os.path.splitext(output)[1] in ['.gz', '.gzip']:
+                outfh = gzip.open(output, 'wb')
+            else:
+                outfh = open(output, 'wb')
+        elif not isinstance(output, bytearray):
+            outfh = output
+        
+        out_buff = bytearray()
+        
+        def __flush(force=False):
+            if force or len(out_buff) >= chunk_size:
+                if outfh is None:
+                    output.extend(out_buff)
+                else:
+                    outfh.write(bytes(out_buff))
+                del out_buff[:]
+        
+        # variant iterator for each sequence
+        variant_stream = None
+        if not isinstance(variants, dict):
+            variant_stream = iter(variants)
+        pending = {'record': None if variant_stream is None else next(variant_stream, None)}
+        unapplied = set()
+        
+        def __variants(entry_id):
+            if variant_stream is None:
+                for record in variants.get(entry_id, []):
+                    yield record
+            else:
+                # variants on the sequences which have been written are out of order
+                while pending['record'] is not None and pending['record']['CHROM'] in liftover:
+                    unapplied.add(pending['record']['CHROM'])
+                    pending['record'] = next(variant_stream, None)
+                while pending['record'] is not None and pending['record']['CHROM'] == entry_id:
+                    yield pending['record']
+                    pending['record'] = next(variant_stream, None)
+        
+        def __allele(record):
+            alts = record['ALT'].split(',')
+            allele = alts[0]
+            if genotype:
+                gt = [a for a in re.split('[/|]', record['INFO'].get('GT', '.')) if a not in ['.', '0', '']]
+                if len(gt) == 0:
+                    return None
+                allele = alts[int(gt[0]) - 1] if int(gt[0]) <= len(alts) else None
+            if allele is None or allele in ['.', '*'] or allele[0:1] == '<' or '[' in allele or ']' in allele:
+                return None
+            return allele.encode()
+        
+        liftover = {}
+        state = {}
+        
+        def __emit(seq):
+            # write bases with line breaks
+            i = 0
+            while i < len(seq):
+                n = min(line_width - state['line_fill'], len(seq) - i)
+                out_buff.extend(seq[i:(i + n)])
+                state['line_fill'] += n
+                i += n
+                if state['line_fill'] == line_width:
+                    out_buff.extend(b'\n')
+                    state['line_fill'] = 0
+            __flush()
+        
+        def __apply(is_last):
+            # apply variants covered by the buffered reference sequence
+            buff = state['buff']
+            while True:
+                record = state['record']
+                if record is None:
+                    break
+                v_start = record['POS']
+                v_end = v_start + len(record['REF']) - 1
+                if v_start < state['cursor']:
+                    state['record'] = next(state['variants'], None)
+                    continue
+                if v_end >= state['buff_start'] + len(buff):
+                    if is_last:
+                        state['record'] = next(state['variants'], None)
+                        continue
+                    break
+                
+                ref = buff[(v_start - state['buff_start']):(v_end - state['buff_start'] + 1)]
+                allele = __allele(record)
+                if allele is not None and ref.upper() == record['REF'].upper().encode():
+                    __emit(buff[(state['cursor'] - state['buff_start']):(v_start - state['buff_start'])])
+                    __emit(allele)
+                    state['cursor'] = v_end + 1
+                    if len(allele) != len(ref):
+                        state['offset'] += len(allele) - len(ref)
+                        state['lift_pos'].append(v_end + 1)
+                        state['lift_offset'].append(state['offset'])
+                state['record'] = next(state['variants'], None)
+            
+            # write bases which are not affected by the following variants
+            emit_to = state['buff_start'] + len(buff)
+            if state['record'] is not None and not is_last:
+                emit_to = min(emit_to, state['record']['POS'])
+            if emit_to > state['cursor']:
+                __emit(buff[(state['cursor'] - state['buff_start']):(emit_to - state['buff_start'])])
+                state['cursor'] = emit_to
+            drop = min(state['cursor'], state['buff_start'] + len(buff)) - state['buff_start']
+            if drop > 0:
+                del buff[:drop]
+                state['buff_start'] += drop
+        
+        def __close_entry():
+            if len(state) > 0:
+                __apply(True)
+                if state['line_fill'] > 0:
+                    out_buff.extend(b'\n')
+                liftover[state['entry_id']] = {'pos': np.array(state['lift_pos'], dtype=np.int64),
+                                               'offset': np.array(state['lift_offset'], dtype=np.int64)}
+                __flush()
+        
+        infh = None
+        if os.path.splitext(file_path)[1] in ['.gz', '.gzip']:
+            infh = gzip.open(file_path, 'rb')
+        else:
+            infh = open(file_path, 'rb')
+        
+        for file_buff in infh:
+            file_buff = file_buff.rstrip(b'\r\n')
+            
+            # entry header
+            if file_buff[0:1] == b'>':
+                __close_entry()
+                # sequence ID is the first word of the header
+                entry_id = (file_buff[1:].split(None, 1) or [b''])[0].decode()
+                out_buff.extend(file_buff + b'\n')
+                state.clear()
+                state.update({'entry_id': entry_id, 'variants': __variants(entry_id), 'buff': bytearray(),
+                              'buff_start': 1, 'cursor': 1, 'line_fill': 0, 'offset': 0,
+                              'lift_pos': [], 'lift_offset': []})
+                state['record'] = next(state['variants'], None)
+            
+            # entry sequence
+            else:
+                state['buff'].extend(file_buff)
+                __apply(False)
+        
+        __close_entry()
+        infh.close()
+        
+        __flush(True)
+        if outfh is not None and isinstance(output, str):
+            outfh.close()
+        
+        # variants left in the stream, whose sequences are not found or not in order
+        if variant_stream is not None and pending['record'] is not None:
+            unapplied.add(pending['record']['CHROM'])
+            for record in variant_stream:
+                unapplied.add(record['CHROM'])
+        if len(unapplied) > 0:
+            raise ValueError('Variants on ' + ', '.join(sorted(unapplied)) + ' were not applied, '
+                             'the sequences are not found in FASTA file or not in the same order.')
+        
+        return liftover
+    
+    
+    
+    
+    def liftover(self, liftover, entry_id, positions):
+        """Convert reference positions into the positions of the consensus sequence.
+        
+        Args:
+            liftover (dict): Output of `build_consensus`.
+            entry_id (str): A sequence ID.
+            positions (array): 1-based positions on the reference sequence.
+        
+        Returns:
+            numpy.ndarray: 1-based positions on the consensus sequence.
+        
+        """
+        
+        positions = np.asarray(positions, dtype=np.int64)
+        lift = liftover[entry_id]
+        i = np.searchsorted(lift['pos'], positions, side='right') - 1
+        offset = np.where(i >= 0, lift['offset'][np.maximum(i, 0)], 0) if len(lift['pos']) > 0 else 0
+        
+        return positions + offset
+    
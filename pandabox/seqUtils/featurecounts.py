@@ -0,0 +1,358 @@
+import os
+import sys
+import gzip
+import numpy as np
+import joblib
+from .gtf import GTF
+
+
+
+class FeatureCounts:
+    '''
+    Count read intervals per gene like featureCounts.
+
+    Exons are loaded with `GTF.parse_gtf` and converted into sorted
+    per-chromosome arrays of non-overlapping segments. Each segment is labeled
+    with the gene covering it (-1 for no gene, -2 for two or more genes),
+    so that batches of read intervals can be assigned with `searchsorted`.
+    Coordinates are 1-based and both ends are inclusive, the same as GTF.
+    '''
+
+    def __init__(self, gtf_file, feature_type='exon', feature_idtag='gene_id', stranded=0, n_jobs=1):
+        '''
+        Args:
+            gtf_file (str): A file path to GTF/GFF file.
+            feature_type (str): The feature type used for counting.
+            feature_idtag (str): The attribute used for grouping features into genes.
+            stranded (int): 0 for unstranded, 1 for stranded, and 2 for reversely
+                            stranded reads.
+            n_jobs (int): The number of jobs for parsing GTF file.
+        '''
+
+        if stranded not in [0, 1, 2]:
+            raise ValueError('Only 0, 1, or 2 can be set in `stranded` argument.')
+        self.stranded = stranded
+
+        gene_ranges = GTF().parse_gtf(gtf_file, feature_type=feature_type, feature_idtag=feature_idtag,
+                                      output_fmt=4, n_jobs=n_jobs)
+
+        # gene ids in order of appearance
+        gene_index = {}
+        for ranges in gene_ranges.values():
+            for r in ranges:
+                if r[0] not in gene_index:
+                    gene_index[r[0]] = len(gene_index)
+        self.gene_ids = list(gene_index.keys())
+
+        # merge exons of each gene into union exons, and calculate the union exon length
+        self.gene_length = np.zeros(len(self.gene_ids), dtype=np.int64)
+        self.index = {}
+        for chr_name, ranges in gene_ranges.items():
+            genes = np.array([gene_index[r[0]] for r in ranges], dtype=np.int64)
+            starts = np.array([r[1] for r in ranges], dtype=np.int64)
+            ends = np.array([r[2] for r in ranges], dtype=np.int64)
+            gene_strand = {gene_index[r[0]]: r[3] for r in ranges}
+
+            genes, starts, ends = self.__merge_exons(genes, starts, ends)
+            self.gene_length += np.bincount(genes, weights=ends - starts + 1,
+                                            minlength=len(self.gene_ids)).astype(np.int64)
+
+            if self.stranded == 0:
+                self.index[chr_name] = self.__build_index(genes, starts, ends)
+            else:
+                strands = np.array([gene_strand[g] for g in genes])
+                for strand in ['+', '-']:
+                    m = (strands == strand)
+                    if np.any(m):
+                        self.index[(chr_name, strand)] = self.__build_index(genes[m], starts[m], ends[m])
+
+
+
+    def __merge_exons(self, genes, starts, ends):
+        # merge overlapping exons of the same gene, the exons of
+        # different genes are kept separately
+        if len(genes) == 0:
+            return genes, starts, ends
+
+        o = np.lexsort((starts, genes))
+        genes = genes[o]
+        starts = starts[o]
+        ends = ends[o]
+
+        # running maximum of exon ends within each gene
+        offset = int(ends.max()) + 1
+        cummax_ends = np.maximum.accumulate(genes * offset + ends) - genes * offset
+
+        is_new = np.ones(len(genes), dtype=bool)
+        is_new[1:] = (genes[1:] != genes[:-1]) | (starts[1:] > cummax_ends[:-1] + 1)
+        group_from = np.flatnonzero(is_new)
+
+        return genes[group_from], starts[group_from], np.maximum.reduceat(ends, group_from)
+
+
+
+    def __build_index(self, genes, starts, ends):
+        # split the chromosome into elementary segments at every exon boundary,
+        # segment i covers [bounds[i], bounds[i + 1] - 1]
+        bounds = np.unique(np.concatenate([starts, ends + 1]))
+        seg_from = np.searchsorted(bounds, starts)
+        seg_to = np.searchsorted(bounds, ends + 1)
+
+        # count genes and sum gene indexes covering each segment
+        n_genes = np.zeros(len(bounds) + 1, dtype=np.int64)
+        np.add.at(n_genes, seg_from, 1)
+        np.add.at(n_genes, seg_to, -1)
+        sum_genes = np.zeros(len(bounds) + 1, dtype=np.int64)
+        np.add.at(sum_genes, seg_from, genes)
+        np.add.at(sum_genes, seg_to, -genes)
+        n_genes = np.cumsum(n_genes)[:-1]
+        sum_genes = np.cumsum(sum_genes)[:-1]
+
+        labels = np.where(n_genes == 1, sum_genes, np.where(n_genes == 0, -1, -2))
+
+        # label[j] is the label of the region which contains positions p
+        # satisfying `searchsorted(bounds, p, 'right') == j`
+        labels = np.concatenate([[-1], labels])
+
+        o = np.argsort(starts, kind='stable')
+        return {'bounds': bounds, 'labels': labels,
+                'min': [np.where(labels >= 0, labels, np.iinfo(np.int64).max)],
+                'max': [np.where(labels >= 0, labels, -1)],
+                'n_ambiguous': np.concatenate([[0], np.cumsum(labels == -2)]),
+                'starts': starts[o], 'ends': ends[o], 'genes': genes[o],
+                'max_length': int((ends - starts).max()) + 1 if len(starts) > 0 else 0}
+
+
+
+    def __range_query(self, index, key, j0, j1):
+        # minimum (or maximum) over labels[j0:(j1 + 1)] with a sparse table,
+        # levels are built on demand up to the longest query range
+        table = index[key]
+        span = int((j1 - j0).max()) + 1 if len(j0) > 0 else 1
+        op = np.minimum if key == 'min' else np.maximum
+        while (1 << (len(table) - 1)) * 2 <= span:
+            k = len(table) - 1
+            prev = table[k]
+            table.append(op(prev[:-(1 << k)], prev[(1 << k):]))
+
+        level = np.floor(np.log2(j1 - j0 + 1)).astype(np.int64)
+        values = np.empty(len(j0), dtype=np.int64)
+        for k in np.unique(level):
+            m = (level == k)
+            values[m] = op(table[k][j0[m]], table[k][j1[m] - (1 << k) + 1])
+        return values
+
+
+
+    def __assign(self, index, starts, ends):
+        j0 = np.searchsorted(index['bounds'], starts, side='right')
+        j1 = np.searchsorted(index['bounds'], ends, side='right')
+
+        # most reads are inside of a single segment
+        assigned = index['labels'][j0].copy()
+        r = np.flatnonzero(j0 != j1)
+        if len(r) > 0:
+            _j0 = j0[r]
+            _j1 = j1[r]
+            gmin = self.__range_query(index, 'min', _j0, _j1)
+            gmax = self.__range_query(index, 'max', _j0, _j1)
+            n_ambiguous = index['n_ambiguous'][_j1 + 1] - index['n_ambiguous'][_j0]
+            assigned[r] = np.where((n_ambiguous > 0) | ((gmax >= 0) & (gmin != gmax)), -2,
+                                   np.where(gmax >= 0, gmax, -1))
+        return assigned
+
+
+
+    def __overlapped_genes(self, index, start, end):
+        # all genes overlapped with the given read, used for multi-overlap reads
+        i_from = np.searchsorted(index['starts'], start - index['max_length'], side='left')
+        i_to = np.searchsorted(index['starts'], end, side='right')
+        m = index['ends'][i_from:i_to] >= start
+        return np.unique(index['genes'][i_from:i_to][m])
+
+
+
+    def __index_key(self, chr_name, strand):
+        if self.stranded == 0:
+            return chr_name
+        if strand not in ['+', '-']:
+            return None
+        if self.stranded == 2:
+            strand = '-' if strand == '+' else '+'
+        return (chr_name, strand)
+
+
+
+    def __groups(self, chr_names, strands):
+        # group read indexes by the index key
+        if self.stranded != 0 and strands is None:
+            raise ValueError('`strands` argument is required for stranded counting.')
+        if self.stranded == 0:
+            keys = np.asarray(chr_names)
+        else:
+            keys = np.char.add(np.char.add(np.asarray(chr_names).astype(str), '\t'), np.asarray(strands).astype(str))
+        uniq_keys, inv = np.unique(keys, return_inverse=True)
+        o = np.argsort(inv, kind='stable')
+        bounds = np.searchsorted(inv[o], np.arange(len(uniq_keys) + 1))
+        for i, k in enumerate(uniq_keys):
+            if self.stranded == 0:
+                key = self.__index_key(str(k), None)
+            else:
+                key = self.__index_key(*str(k).rsplit('\t', 1))
+            yield key, o[bounds[i]:bounds[i + 1]]
+
+
+
+    def assign(self, chr_names, starts, ends, strands=None):
+        '''Assign read intervals to genes.
+
+        Args:
+            chr_names (array): Chromosome names of the reads.
+            starts (array): 1-based start positions of the reads.
+            ends (array): 1-based end positions (inclusive) of the reads.
+            strands (array): Strands ('+' or '-') of the reads, required if `stranded` is not 0.
+
+        Returns:
+            numpy.ndarray: Gene indexes (in `gene_ids`) assigned to the reads,
+                           -1 for no feature, and -2 for ambiguous reads which
+                           overlap two or more genes.
+        '''
+
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        assigned = np.full(len(starts), -1, dtype=np.int64)
+
+        for key, r in self.__groups(chr_names, strands):
+            if key in self.index:
+                assigned[r] = self.__assign(self.index[key], starts[r], ends[r])
+
+        return assigned
+
+
+
+    def count_intervals(self, chr_names, starts, ends, strands=None, allow_multi_overlap=False):
+        '''Count read intervals per gene.
+
+        Args:
+            chr_names (array): Chromosome names of the reads.
+            starts (array): 1-based start positions of the reads.
+            ends (array): 1-based end positions (inclusive) of the reads.
+            strands (array): Strands ('+' or '-') of the reads, required if `stranded` is not 0.
+            allow_multi_overlap (bool): If `True`, reads overlapping two or more genes
+                                        are counted for every overlapped gene.
+
+        Returns:
+            numpy.ndarray: Counts of reads for each gene in `gene_ids`.
+        '''
+
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        counts = np.zeros(len(self.gene_ids), dtype=np.int64)
+
+        for key, r in self.__groups(chr_names, strands):
+            if key not in self.index:
+                continue
+            index = self.index[key]
+            assigned = self.__assign(index, starts[r], ends[r])
+            counts += np.bincount(assigned[assigned >= 0], minlength=len(self.gene_ids))
+
+            if allow_multi_overlap:
+                for i in r[assigned == -2]:
+                    counts[self.__overlapped_genes(index, starts[i], ends[i])] += 1
+
+        return counts
+
+
+
+    def __count_file(self, file_path, file_format, allow_multi_overlap, batch_size):
+        if file_format not in ['bed', 'tsv']:
+            raise ValueError('Only `bed` or `tsv` can be set in `file_format` argument.')
+
+        counts = np.zeros(len(self.gene_ids), dtype=np.int64)
+
+        def __count_batch(batch):
+            chr_names = [r[0] for r in batch]
+            starts = np.array([r[1] for r in batch], dtype=np.int64)
+            ends = np.array([r[2] for r in batch], dtype=np.int64)
+            strands = None
+            if self.stranded != 0:
+                strands = [r[5] if len(r) > 5 else '.' for r in batch] if file_format == 'bed' else \
+                          [r[3] if len(r) > 3 else '.' for r in batch]
+            # BED is 0-based and half-open
+            if file_format == 'bed':
+                starts = starts + 1
+            return self.count_intervals(chr_names, starts, ends, strands, allow_multi_overlap)
+
+        infh = None
+        if os.path.splitext(file_path)[1] in ['.gz', '.gzip']:
+            infh = gzip.open(file_path, 'rt')
+        else:
+            infh = open(file_path, 'r')
+
+        batch = []
+        for buf in infh:
+            if buf[0:1] == '#' or buf.startswith('track') or buf.startswith('browser'):
+                continue
+            buf_records = buf.rstrip('\n').split('\t')
+            if len(buf_records) < 3:
+                continue
+            batch.append(buf_records)
+            if len(batch) >= batch_size:
+                counts += __count_batch(batch)
+                batch = []
+        if len(batch) > 0:
+            counts += __count_batch(batch)
+
+        infh.close()
+
+        return counts
+
+
+
+    def count(self, file_paths, file_format='bed', sample_names=None, allow_multi_overlap=False,
+              normalize=None, batch_size=1000000, n_jobs=1):
+        '''Count reads per gene for each sample.
+
+        Args:
+            file_paths (list): File paths to BED (0-based, half-open) or TSV
+                               (chromosome, 1-based start, end, and strand) files,
+                               one file for one sample.
+            file_format (str): `bed` or `tsv`.
+            sample_names (list): Sample names, the file names are used by default.
+            allow_multi_overlap (bool): If `True`, reads overlapping two or more genes
+                                        are counted for every overlapped gene.
+            normalize (str): `None` for raw counts, `rpk` for reads per kilobase of
+                             union exon length, `rpkm` or `tpm`.
+            batch_size (int): The number of reads assigned at once.
+            n_jobs (int): The number of jobs, samples are processed in parallel.
+
+        Returns:
+            dict: A dictionary contains `gene_id`, `sample`, and `counts`
+                  which is a matrix of genes x samples.
+        '''
+
+        if isinstance(file_paths, str):
+            file_paths = [file_paths]
+        if sample_names is None:
+            sample_names = [os.path.basename(f) for f in file_paths]
+        if normalize not in [None, 'rpk', 'rpkm', 'tpm']:
+            raise ValueError('Only None, `rpk`, `rpkm`, or `tpm` can be set in `normalize` argument.')
+
+        def __count(file_path):
+            return self.__count_file(file_path, file_format, allow_multi_overlap, batch_size)
+
+        counts = joblib.Parallel(n_jobs=n_jobs, verbose=0)([joblib.delayed(__count)(f) for f in file_paths])
+        counts = np.array(counts).T
+
+        if normalize is not None:
+            gene_length = np.where(self.gene_length > 0, self.gene_length, 1)[:, np.newaxis]
+            if normalize == 'rpkm':
+                counts = counts / (gene_length / 1e3) / (np.maximum(counts.sum(axis=0), 1) / 1e6)
+            else:
+                counts = counts / (gene_length / 1e3)
+                if normalize == 'tpm':
+                    counts = counts / np.maximum(counts.sum(axis=0), 1e-12) * 1e6
+
+        return {'gene_id': self.gene_ids, 'sample': sample_names, 'counts': counts}
+
+
@@ -0,0 +1,253 @@
+import os
+import sys
+import math
+import numpy as np
+from .vcf import VCF
+
+
+
+# 2-bit genotype codes, 0, 1, and 2 for the number of non-reference alleles, and 3 for missing
+_MISSING = 3
+
+# per-byte lookup tables, each byte packs genotypes of 4 samples
+_BYTE_CODES = ((np.arange(256)[:, np.newaxis] >> np.array([0, 2, 4, 6])) & 3).astype(np.int8)
+_BYTE_N_CALLED = (_BYTE_CODES != _MISSING).sum(axis=1).astype(np.uint8)
+_BYTE_N_ALT = np.where(_BYTE_CODES != _MISSING, _BYTE_CODES, 0).sum(axis=1).astype(np.uint8)
+_BYTE_N_HET = (_BYTE_CODES == 1).sum(axis=1).astype(np.uint8)
+_BYTE_N_HOM_ALT = (_BYTE_CODES == 2).sum(axis=1).astype(np.uint8)
+
+_erfc = np.vectorize(math.erfc, otypes=[np.float64])
+
+
+
+class PackedGenotype:
+    '''
+    Genotype matrix (variants x samples) packed into 2 bits per genotype.
+
+    Genotypes of 4 samples are packed into a byte, similar to PLINK .bed,
+    which needs 4 times less memory than int8 matrix. The packed matrix can be
+    built from VCF file in a streaming way, and saved to and memory-mapped from
+    `<prefix>.pgt` (packed matrix) and `<prefix>.pgt.npz` (samples and positions).
+    '''
+
+    def __init__(self):
+        self.samples = []
+        self.chrom = np.zeros(0, dtype=str)
+        self.pos = np.zeros(0, dtype=np.int64)
+        self.packed = np.zeros((0, 0), dtype=np.uint8)
+
+
+
+    def __len__(self):
+        return self.packed.shape[0]
+
+
+
+    def pack(self, gt):
+        '''Pack genotype matrix.
+
+        Args:
+            gt (numpy.ndarray): Genotypes coded as 0, 1, 2, and -1 for missing
+                                (variants x samples), e.g., `GT` of `VCF.parse_vcf_columns`.
+
+        Returns:
+            numpy.ndarray: Packed genotypes (uint8, variants x ceil(samples / 4)).
+        '''
+
+        gt = np.asarray(gt)
+        n_variants, n_samples = gt.shape
+        codes = np.full((n_variants, int((n_samples + 3) / 4) * 4), _MISSING, dtype=np.uint8)
+        codes[:, :n_samples] = np.where((gt >= 0) & (gt <= 2), gt, _MISSING)
+        codes = codes.reshape(n_variants, -1, 4)
+
+        return codes[:, :, 0] | (codes[:, :, 1] << 2) | (codes[:, :, 2] << 4) | (codes[:, :, 3] << 6)
+
+
+
+    def unpack(self, start=0, end=None):
+        '''Unpack genotypes of the variants in [start, end).
+
+        Returns:
+            numpy.ndarray: Genotypes (int8, variants x samples), -1 for missing.
+        '''
+
+        gt = _BYTE_CODES[self.packed[start:end]].reshape(-1, self.packed.shape[1] * 4)[:, :len(self.samples)]
+        return np.where(gt == _MISSING, -1, gt).astype(np.int8)
+
+
+
+    def pack_vcf(self, file_path, output_prefix=None, chr_name=None, pos_range=None, batch_size=10000):
+        '''Pack genotypes of VCF file.
+
+        VCF file is parsed with `VCF.iter_vcf_genotypes` and packed batch by batch.
+        If `output_prefix` is given, the packed matrix is written to the files while
+        parsing and then memory-mapped, so the whole matrix is never held in memory.
+
+        Args:
+            file_path (str): A file path to VCF file.
+            output_prefix (str): A prefix of the output files.
+            chr_name (str): Pack only the variants on the chromosome.
+            pos_range (list): Pack only the variants in [start, end].
+            batch_size (int): The number of variants parsed and packed at once.
+        '''
+
+        chrom = []
+        pos = []
+        packed = []
+        samples = []
+
+        outfh = None
+        if output_prefix is not None:
+            outfh = open(output_prefix + '.pgt', 'wb')
+
+        for batch in VCF().iter_vcf_genotypes(file_path, chr_name=chr_name, pos_range=pos_range, batch_size=batch_size):
+            samples = batch['samples']
+            chrom.append(batch['CHROM'])
+            pos.append(batch['POS'])
+            if outfh is None:
+                packed.append(self.pack(batch['GT']))
+            else:
+                outfh.write(self.pack(batch['GT']).tobytes())
+
+        self.samples = samples
+        self.chrom = np.concatenate(chrom) if len(chrom) > 0 else np.zeros(0, dtype=str)
+        self.pos = np.concatenate(pos) if len(pos) > 0 else np.zeros(0, dtype=np.int64)
+
+        if outfh is None:
+            self.packed = np.vstack(packed) if len(packed) > 0 else np.zeros((0, int((len(samples) + 3) / 4)), dtype=np.uint8)
+        else:
+            outfh.close()
+            self.__save_meta(output_prefix)
+            self.load(output_prefix)
+
+
+
+    def __save_meta(self, output_prefix):
+        np.savez(output_prefix + '.pgt.npz', samples=np.array(self.samples, dtype=str),
+                 chrom=self.chrom, pos=self.pos)
+
+
+
+    def save(self, output_prefix):
+        '''Save packed genotypes to `<output_prefix>.pgt` and `<output_prefix>.pgt.npz`.'''
+
+        with open(output_prefix + '.pgt', 'wb') as outfh:
+            outfh.write(np.ascontiguousarray(self.packed).tobytes())
+        self.__save_meta(output_prefix)
+
+
+
+    def load(self, file_prefix, mmap=True):
+        '''Load packed genotypes saved with `save` or `pack_vcf`.
+
+        Args:
+            file_prefix (str): A prefix of the files.
+            mmap (bool): If `True`, the packed matrix is memory-mapped instead of being read.
+        '''
+
+        with np.load(file_prefix + '.pgt.npz') as meta:
+            self.samples = meta['samples'].tolist()
+            self.chrom = meta['chrom']
+            self.pos = meta['pos']
+
+        shape = (len(self.pos), int((len(self.samples) + 3) / 4))
+        if mmap and shape[0] * shape[1] > 0:
+            self.packed = np.memmap(file_prefix + '.pgt', dtype=np.uint8, mode='r', shape=shape)
+        else:
+            self.packed = np.fromfile(file_prefix + '.pgt', dtype=np.uint8).reshape(shape)
+
+
+
+    def __counts(self, start, end):
+        # genotype counts of the variants in [start, end)
+        block = self.packed[start:end]
+        n_called = _BYTE_N_CALLED[block].sum(axis=1, dtype=np.int64)
+        n_het = _BYTE_N_HET[block].sum(axis=1, dtype=np.int64)
+        n_hom_alt = _BYTE_N_HOM_ALT[block].sum(axis=1, dtype=np.int64)
+        return {'n_called': n_called,
+                'n_alt': _BYTE_N_ALT[block].sum(axis=1, dtype=np.int64),
+                'n_hom_ref': n_called - n_het - n_hom_alt,
+                'n_het': n_het,
+                'n_hom_alt': n_hom_alt}
+
+
+
+    def stats(self, start=0, end=None, block_size=10000):
+        '''Calculate population statistics of variants.
+
+        Statistics are calculated block by block, each block contains
+        `block_size` variants, so that memory-mapped genotypes are not loaded
+        at once.
+
+        Args:
+            start (int): The first variant index.
+            end (int): The last variant index (exclusive), the last variant by default.
+            block_size (int): The number of variants in a block.
+
+        Returns:
+            dict: A dictionary contains arrays of `alt_freq` (alternative allele
+                  frequency), `missing_rate`, `het_rate` (heterozygosity of called
+                  genotypes), and `hwe_pvalue` (chi-square test of Hardy-Weinberg
+                  equilibrium with 1 degree of freedom), and genotype counts.
+        '''
+
+        if end is None:
+            end = len(self)
+
+        counts = {}
+        for block_from in range(start, end, block_size):
+            _counts = self.__counts(block_from, min(block_from + block_size, end))
+            for k, v in _counts.items():
+                if k not in counts:
+                    counts[k] = []
+                counts[k].append(v)
+        for k in ['n_called', 'n_alt', 'n_hom_ref', 'n_het', 'n_hom_alt']:
+            counts[k] = np.concatenate(counts[k]) if k in counts else np.zeros(0, dtype=np.int64)
+
+        n_called = counts['n_called']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            alt_freq = counts['n_alt'] / (2 * n_called)
+            het_rate = counts['n_het'] / n_called
+
+            # expected genotype counts under Hardy-Weinberg equilibrium
+            p = 1 - alt_freq
+            chi2 = np.zeros(len(n_called))
+            for obs, exp in [(counts['n_hom_ref'], n_called * p * p),
+                             (counts['n_het'], 2 * n_called * p * (1 - p)),
+                             (counts['n_hom_alt'], n_called * (1 - p) * (1 - p))]:
+                chi2 = chi2 + np.where(exp > 0, (obs - exp) ** 2 / exp, 0)
+            hwe_pvalue = np.where(n_called > 0, _erfc(np.sqrt(chi2 / 2)), np.nan)
+
+        counts.update({
+            'alt_freq': alt_freq,
+            'missing_rate': 1 - n_called / len(self.samples) if len(self.samples) > 0 else np.zeros(len(n_called)),
+            'het_rate': het_rate,
+            'hwe_pvalue': hwe_pvalue
+        })
+        return counts
+
+
+
+    def ld_r2(self, start=0, end=None):
+        '''Calculate pairwise LD (r^2) between the variants in [start, end).
+
+        Missing genotypes are imputed by the mean dosage of each variant.
+
+        Returns:
+            numpy.ndarray: A matrix of r^2 (variants x variants).
+        '''
+
+        gt = self.unpack(start, end)
+        is_called = (gt >= 0)
+        gt = np.where(is_called, gt, 0).astype(np.float32)
+        mean = gt.sum(axis=1, keepdims=True) / np.maximum(is_called.sum(axis=1, keepdims=True), 1)
+        gt = np.where(is_called, gt - mean, 0)
+
+        norm = np.sqrt((gt * gt).sum(axis=1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = (gt @ gt.T) / np.outer(norm, norm)
+        r[~np.isfinite(r)] = 0
+
+        return r * r
+
+
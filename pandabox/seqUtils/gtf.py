@@ -1,7 +1,104 @@
 import os
 import sys
 import re
+import io
 import gzip
+import struct
+import joblib
+
+
+
+def _parse_gtf_records(infh, gene_ranges, feature_type, geneid_pattern, feature_id, output_fmt):
+    # parse GTF/GFF records from a text stream and store them into `gene_ranges`
+    for file_buff in infh:
+        gtf_record = file_buff.replace('\n', '').split('\t')
+        if len(gtf_record) < 9:
+            continue
+            
+        # only search the specified feature type
+        if gtf_record[2] == feature_type:
+                
+            # find feature id (gene id, exon id, etc...)
+            m = geneid_pattern.search(gtf_record[8])
+            if m:
+                fid = m.group(1)
+                    
+                if feature_id is not None and feature_id != fid:
+                    continue
+                    
+                    
+                # add record if every conditions are satisfied
+                if gtf_record[0] not in gene_ranges:
+                    gene_ranges[gtf_record[0]] = []
+
+                if output_fmt == 3:
+                    gene_ranges[gtf_record[0]].append([fid, int(gtf_record[3]), int(gtf_record[4])])
+                elif output_fmt == 2:
+                    gene_ranges[gtf_record[0]].append([int(gtf_record[3]), int(gtf_record[4])])
+                elif output_fmt == 4:
+                    gene_ranges[gtf_record[0]].append([fid, int(gtf_record[3]), int(gtf_record[4]), gtf_record[6]])
+                else:
+                    raise ValueError('Only 2, 3, or 4 can be set in `output_fmt` argument.')
+    
+    return gene_ranges
+
+
+
+def _bgzf_block_offsets(file_path):
+    # return the file offsets of all BGZF blocks, or None if the file is not BGZF
+    offsets = []
+    file_size = os.path.getsize(file_path)
+    
+    with open(file_path, 'rb') as infh:
+        offset = 0
+        while offset < file_size:
+            infh.seek(offset)
+            header = infh.read(12)
+            if len(header) < 12 or header[0:4] != b'\x1f\x8b\x08\x04':
+                return None
+            xlen = struct.unpack('<H', header[10:12])[0]
+            extra = infh.read(xlen)
+            
+            # find `BC` subfield which contains the block size
+            bsize = None
+            i = 0
+            while i + 4 <= len(extra):
+                slen = struct.unpack('<H', extra[i + 2:i + 4])[0]
+                if extra[i:i + 2] == b'BC' and slen == 2:
+                    bsize = struct.unpack('<H', extra[i + 4:i + 6])[0]
+                    break
+                i = i + 4 + slen
+            if bsize is None:
+                return None
+            
+            offsets.append(offset)
+            offset = offset + bsize + 1
+    
+    return offsets
+
+
+
+def _parse_gtf_chunk(file_path, start, end, is_bgzf, feature_type, geneid_pattern, feature_id, output_fmt):
+    # parse a byte range [start, end) of the (BGZF compressed) GTF/GFF file.
+    # the partial line at the beginning of the range belongs to the previous chunk,
+    # and the partial line at the end of the range is completed by reading the next chunk.
+    with open(file_path, 'rb') as infh:
+        infh.seek(start)
+        chunk_buff = infh.read(end - start)
+        if is_bgzf:
+            chunk_buff = gzip.decompress(chunk_buff)
+            chunk_buff = chunk_buff + gzip.GzipFile(fileobj=infh, mode='rb').readline()
+        else:
+            chunk_buff = chunk_buff + infh.readline()
+    
+    if start > 0:
+        chunk_buff = chunk_buff[(chunk_buff.find(b'\n') + 1):] if b'\n' in chunk_buff else b''
+    
+    return _parse_gtf_records(io.TextIOWrapper(io.BytesIO(chunk_buff)), {},
+                              feature_type, geneid_pattern, feature_id, output_fmt)
+    
+    
+
 
 
 class GTF:
@@ -11,26 +108,23 @@ class GTF:
     
     
     
-    def parse_gtf(self, file_path, feature_type='gene', feature_idtag='gene_id', feature_id=None, output_fmt=3):
+    def parse_gtf(self, file_path, feature_type='gene', feature_idtag='gene_id', feature_id=None, output_fmt=3,
+                  n_jobs=1, chunk_size=64 * 1024 * 1024):
         '''
         Input: /path/to/gtf
         Output: dictionary containing lists of gene annotations.
                 the chromosome name/number is set as dictionary keys,
                 and value is set as lists of gene annotations.
+                `output_fmt=3` gives [id, start, end], `output_fmt=2` gives
+                [start, end], and `output_fmt=4` gives [id, start, end, strand].
         
+        If `n_jobs` is not 1, the file is split into byte ranges of about `chunk_size`
+        bytes (or groups of BGZF blocks for BGZF compressed files), and the ranges
+        are parsed in parallel. The results are merged in file order, therefore the
+        output is identical to the serial parsing. Plain gzip files can not be split
+        and are always parsed serially.
         '''
         
-        gene_ranges = {}
-        
-       
-
-        infh = None
-        if os.path.splitext(file_path)[1] in ['.gz', '.gzip']:
-            infh = gzip.open(file_path, 'rt')
-        else:
-            infh = open(file_path, 'r')
-        
-
         # check format (GTF or GFF) and set the regex pattern
         file_path_wihtoutgz = re.sub('\.gz$|\.gzip$', '', file_path)
         if os.path.splitext(file_path_wihtoutgz)[1] == '.gtf':
@@ -38,36 +132,53 @@ class GTF:
         else:
             geneid_pattern = re.compile(feature_idtag + ':([^:;]+);')
         
+        is_gz = os.path.splitext(file_path)[1] in ['.gz', '.gzip']
         
-        for file_buff in infh:
-            gtf_record = file_buff.replace('\n', '').split('\t')
-            if len(gtf_record) < 9:
-                continue
-                
-            # only search the specified feature type
-            if gtf_record[2] == feature_type:
-                    
-                # find feature id (gene id, exon id, etc...)
-                m = geneid_pattern.search(gtf_record[8])
-                if m:
-                    fid = m.group(1)
-                        
-                    if feature_id is not None and feature_id != fid:
-                        continue
-                        
-                        
-                    # add record if every conditions are satisfied
-                    if gtf_record[0] not in gene_ranges:
-                        gene_ranges[gtf_record[0]] = []
-    
-                    if output_fmt == 3:
-                        gene_ranges[gtf_record[0]].append([fid, int(gtf_record[3]), int(gtf_record[4])])
-                    elif output_fmt == 2:
-                        gene_ranges[gtf_record[0]].append([int(gtf_record[3]), int(gtf_record[4])])
-                    else:
-                        raise ValueError('Only 2 or 3 can be set in `output_fmt` argument.')
-                
-        infh.close()
+        
+        # split file into byte ranges for parallel parsing
+        chunks = None
+        if n_jobs != 1:
+            if is_gz:
+                block_offsets = _bgzf_block_offsets(file_path)
+                if block_offsets is not None:
+                    chunks = []
+                    chunk_start = 0
+                    for block_offset in block_offsets[1:]:
+                        if block_offset - chunk_start >= chunk_size:
+                            chunks.append([chunk_start, block_offset])
+                            chunk_start = block_offset
+                    chunks.append([chunk_start, os.path.getsize(file_path)])
+            else:
+                file_size = os.path.getsize(file_path)
+                n_chunks = max(joblib.effective_n_jobs(n_jobs), int((file_size - 1) / chunk_size) + 1)
+                chunk_bounds = [int(file_size * i / n_chunks) for i in range(n_chunks + 1)]
+                chunks = [[chunk_bounds[i], chunk_bounds[i + 1]] for i in range(n_chunks)
+                          if chunk_bounds[i] < chunk_bounds[i + 1]]
+        
+        
+        if chunks is None:
+            infh = None
+            if is_gz:
+                infh = gzip.open(file_path, 'rt')
+            else:
+                infh = open(file_path, 'r')
+            
+            gene_ranges = _parse_gtf_records(infh, {}, feature_type, geneid_pattern, feature_id, output_fmt)
+            infh.close()
+        
+        else:
+            chunk_ranges = joblib.Parallel(n_jobs=n_jobs, verbose=0)(
+                    [joblib.delayed(_parse_gtf_chunk)(file_path, chunk_start, chunk_end, is_gz,
+                                                      feature_type, geneid_pattern, feature_id, output_fmt)
+                     for chunk_start, chunk_end in chunks])
+            
+            # merge chunks in file order
+            gene_ranges = {}
+            for _gene_ranges in chunk_ranges:
+                for chr_name, ranges in _gene_ranges.items():
+                    if chr_name not in gene_ranges:
+                        gene_ranges[chr_name] = []
+                    gene_ranges[chr_name].extend(ranges)
                 
         return gene_ranges
     
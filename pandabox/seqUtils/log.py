@@ -1,6 +1,182 @@
 import os
 import sys
 import re
+import glob
+import pickle
+import asyncio
+import numpy as np
+import joblib
+
+
+
+def _parse_star_value(val):
+    # convert value of STAR log into int (counts), float (percentages and rates), or str (dates)
+    if val.endswith('%'):
+        val = val[:-1]
+    for conv in [int, float]:
+        try:
+            return conv(val)
+        except ValueError:
+            pass
+    return val
+
+_STAR_PROGRESS_FIELDS = ['speed', 'read_number', 'read_length', 'mapped_unique', 'mapped_length',
+                         'mapped_mmrate', 'mapped_multi', 'mapped_multi_plus', 'unmapped_mm',
+                         'unmapped_short', 'unmapped_other']
+
+
+
+class StarProgressWatcher:
+    '''
+    Tail STAR-aligner progress log files (*Log.progress.out) with asyncio.
+    
+    The watcher remembers the byte offset of each file, and only the newly
+    appended lines are read and parsed at every poll. Parsed records are
+    stored in `series` as time series of each file, and the updates are
+    yielded by `async for`, which finishes when all files report `ALL DONE!`.
+    
+    ```
+    watcher = StarProgressWatcher('results/*/Log.progress.out', interval=10)
+    async for updates in watcher:
+        for file_path, records in updates.items():
+            print(file_path, records[-1]['mapped_unique'])
+    ```
+    '''
+    
+    def __init__(self, file_paths, interval=5.0):
+        '''
+        Args:
+            file_paths (str, list): A glob pattern (evaluated at every poll, so
+                                    new log files are found), or a list of file paths.
+            interval (float): Interval of polling in seconds.
+        '''
+        
+        self.file_paths = file_paths
+        self.interval = interval
+        self.offsets = {}
+        self.remainders = {}
+        self.series = {}
+        self.done = set()
+        self.watched = set()
+    
+    
+    
+    def __parse_line(self, line):
+        # parse a line such as `Mar 09 16:26:57  3.6  1012346  202  87.0%  199.4  0.3%  ...`
+        tokens = line.split()
+        if len(tokens) != 3 + len(_STAR_PROGRESS_FIELDS):
+            return None
+        try:
+            record = {'time': ' '.join(tokens[:3])}
+            for field, val in zip(_STAR_PROGRESS_FIELDS, tokens[3:]):
+                record[field] = float(val.rstrip('%'))
+        except ValueError:
+            return None
+        return record
+    
+    
+    
+    def __read_updates(self):
+        # read newly appended lines of all files, this runs in a worker thread
+        if isinstance(self.file_paths, str):
+            file_paths = sorted(glob.glob(self.file_paths))
+        else:
+            file_paths = self.file_paths
+        # files listed but not yet created or written are watched as unfinished
+        self.watched.update(file_paths)
+        
+        updates = {}
+        for file_path in file_paths:
+            if file_path in self.done:
+                continue
+            try:
+                file_size = os.stat(file_path).st_size
+            except OSError:
+                continue
+            
+            offset = self.offsets.get(file_path, 0)
+            if file_size < offset:
+                # the file is truncated, e.g., the job is restarted
+                offset = 0
+                self.remainders[file_path] = b''
+                self.series[file_path] = []
+            if file_size == offset:
+                continue
+            
+            with open(file_path, 'rb') as infh:
+                infh.seek(offset)
+                buff = self.remainders.get(file_path, b'') + infh.read(file_size - offset)
+            self.offsets[file_path] = file_size
+            
+            # keep the last incomplete line for the next poll
+            lines = buff.split(b'\n')
+            self.remainders[file_path] = lines[-1]
+            
+            records = []
+            for line in lines[:-1]:
+                line = line.decode()
+                if 'ALL DONE' in line:
+                    self.done.add(file_path)
+                    continue
+                record = self.__parse_line(line)
+                if record is not None:
+                    records.append(record)
+            
+            if file_path not in self.series:
+                self.series[file_path] = []
+            self.series[file_path].extend(records)
+            if len(records) > 0:
+                updates[file_path] = records
+        
+        return updates
+    
+    
+    
+    async def poll(self):
+        '''Read newly appended lines once.
+        
+        Returns:
+            dict: A dictionary whose keys are file paths and values are lists of new records.
+        '''
+        
+        return await asyncio.get_running_loop().run_in_executor(None, self.__read_updates)
+    
+    
+    
+    def is_done(self):
+        # all watched files exist and their completion lines have been read
+        return len(self.watched) > 0 and all(f in self.done for f in self.watched)
+    
+    
+    
+    def to_arrays(self, file_path):
+        '''Convert time series of a file into arrays.'''
+        
+        records = self.series.get(file_path, [])
+        arrays = {'time': np.array([r['time'] for r in records], dtype=object)}
+        for field in _STAR_PROGRESS_FIELDS:
+            arrays[field] = np.array([r[field] for r in records], dtype=np.float64)
+        return arrays
+    
+    
+    
+    def __aiter__(self):
+        return self
+    
+    
+    
+    async def __anext__(self):
+        while True:
+            updates = await self.poll()
+            if len(updates) > 0:
+                return updates
+            if self.is_done():
+                raise StopAsyncIteration
+            await asyncio.sleep(self.interval)
+
+
+
+
 
 class LogFile:
     
@@ -47,8 +223,114 @@ class LogFile:
 
         file_name = os.path.basename(file_path)
         return [file_path, file_name, uniq_r, multi_r, much_r]
+    
+    
+    
+    def parse_star_log_fields(self, file_path):
+        '''Parse all fields of STAR-aligner final log file.
+        
+        Args:
+            file_path (str): A file path to log file.
+        
+        Returns:
+            dict: A dictionary whose keys are field names (e.g.,
+                  `Uniquely mapped reads %`) and values are the values,
+                  counts are converted into int, and percentages and
+                  rates are converted into float.
+        '''
+        
+        fields = {}
+        with open(file_path, 'r') as infh:
+            for buf in infh:
+                buf_records = buf.split('|', 1)
+                if len(buf_records) == 2:
+                    fields[buf_records[0].strip()] = _parse_star_value(buf_records[1].strip())
+        
+        return fields
+    
+    
+    
+    def parse_star_logs(self, input_path, cache_file=None, n_jobs=-1):
+        '''Parse STAR-aligner final log files into a table.
+        
+        Args:
+            input_path (str, list): A path to a directory (searched recursively for
+                                    `*Log.final.out`), a glob pattern, or a list of
+                                    file paths.
+            cache_file (str): A path to a cache file. Parsed fields are cached with
+                              modification times and sizes of the log files, and
+                              only the changed files are parsed at the next time.
+            n_jobs (int): The number of threads.
+        
+        Returns:
+            dict: A table whose keys are `file_path`, `file_name` and the field
+                  names, and values are arrays of the log files. Count fields are
+                  int64, the other numeric fields are float64 (NaN for missing),
+                  and the others are object.
+        '''
+        
+        if isinstance(input_path, (list, tuple)):
+            file_paths = list(input_path)
+        elif os.path.isdir(input_path):
+            file_paths = glob.glob(os.path.join(input_path, '**', '*Log.final.out'), recursive=True)
+        else:
+            file_paths = glob.glob(input_path)
+        file_paths = sorted(file_paths)
+        
+        cache = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, 'rb') as infh:
+                cache = pickle.load(infh)
+        
+        # parse only new or changed files
+        file_stats = {}
+        for file_path in file_paths:
+            file_stat = os.stat(file_path)
+            file_stats[file_path] = (file_stat.st_mtime_ns, file_stat.st_size)
+        changed_file_paths = [f for f in file_paths if f not in cache or cache[f][0] != file_stats[f]]
         
+        parsed_fields = joblib.Parallel(n_jobs=n_jobs, prefer='threads', verbose=0)(
+                [joblib.delayed(self.parse_star_log_fields)(f) for f in changed_file_paths])
+        for file_path, fields in zip(changed_file_paths, parsed_fields):
+            cache[file_path] = (file_stats[file_path], fields)
         
+        if cache_file is not None:
+            cache = {f: cache[f] for f in file_paths}
+            with open(cache_file, 'wb') as outfh:
+                pickle.dump(cache, outfh)
         
+        # make table
+        field_names = []
+        for file_path in file_paths:
+            for field_name in cache[file_path][1].keys():
+                if field_name not in field_names:
+                    field_names.append(field_name)
+        
+        table = {'file_path': np.array(file_paths, dtype=object),
+                 'file_name': np.array([os.path.basename(f) for f in file_paths], dtype=object)}
+        for field_name in field_names:
+            vals = [cache[f][1].get(field_name, None) for f in file_paths]
+            if all(isinstance(v, int) for v in vals):
+                table[field_name] = np.array(vals, dtype=np.int64)
+            elif all(v is None or isinstance(v, (int, float)) for v in vals):
+                table[field_name] = np.array([np.nan if v is None else v for v in vals], dtype=np.float64)
+            else:
+                table[field_name] = np.array(vals, dtype=object)
+        
+        return table
+    
+    
+    
+    def watch_star_progress(self, file_paths, interval=5.0):
+        '''Watch STAR-aligner progress log files.
+        
+        Args:
+            file_paths (str, list): A glob pattern or a list of `*Log.progress.out` files.
+            interval (float): Interval of polling in seconds.
+        
+        Returns:
+            StarProgressWatcher: An asynchronous iterator which yields new records.
+        '''
         
+        return StarProgressWatcher(file_paths, interval)
         
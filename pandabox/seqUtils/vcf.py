@@ -2,6 +2,121 @@ import os
 import sys
 import re
 import gzip
+import json
+import shutil
+import hashlib
+import numpy as np
+
+
+
+def _parse_header_line(header_line, header):
+    # store Number and Type of the INFO/FORMAT field defined in the header line
+    m = re.match(r'##(INFO|FORMAT)=<(.*)>', header_line.strip())
+    if m:
+        field_id = re.search(r'(?:^|,)ID=([^,]+)', m.group(2))
+        number = re.search(r'(?:^|,)Number=([^,]+)', m.group(2))
+        field_type = re.search(r'(?:^|,)Type=([^,]+)', m.group(2))
+        if field_id:
+            header[m.group(1)][field_id.group(1)] = (number.group(1) if number else '.',
+                                                     field_type.group(1) if field_type else 'String')
+    return header
+
+
+
+def _info_value(info, key):
+    # find the value of the key in INFO column (str or bytes) without splitting
+    # the whole column, return True for flags and None if the key is not found
+    sep = ';' if isinstance(info, str) else b';'
+    eq = '=' if isinstance(info, str) else b'='
+    i = (sep + info).find(sep + key + eq)
+    if i >= 0:
+        j = info.find(sep, i + len(key) + 1)
+        return info[(i + len(key) + 1):(None if j < 0 else j)]
+    if (sep + info + sep).find(sep + key + sep) >= 0:
+        return True
+    return None
+
+
+
+_FIELD_TYPES = {'Integer': (int, np.int32, -1), 'Float': (float, np.float32, np.nan),
+                'Flag': (bool, bool, False), 'String': (str, object, None), 'Character': (str, object, None)}
+
+def _convert_value(val, definition):
+    # convert the attribute text into the value according to the header definition,
+    # fields with `Number=1` are converted into scalars, and the others into lists
+    if val is None or val == '.' or val == '':
+        return False if definition[1] == 'Flag' else None
+    if definition[1] == 'Flag':
+        return True
+    conv = _FIELD_TYPES.get(definition[1], _FIELD_TYPES['String'])[0]
+    if definition[0] == '1':
+        return conv(val)
+    return [None if v == '.' else conv(v) for v in val.split(',')]
+
+
+
+def _column_value(val, definition):
+    # convert the attribute text into a scalar for typed arrays, fields with
+    # `Number=A` are converted into the value of the first ALT allele, and the
+    # other fields with multiple values are kept as text
+    conv, dtype, missing = _FIELD_TYPES.get(definition[1], _FIELD_TYPES['String'])
+    if definition[1] == 'Flag':
+        return val is not None and val is not False
+    if definition[0] not in ['1', 'A']:
+        dtype, missing = object, None
+    if val is None or val is True or val == '.' or val == '':
+        return missing
+    if dtype is object:
+        return val
+    if definition[0] == 'A':
+        val = val.split(',', 1)[0]
+        if val == '.':
+            return missing
+    return conv(val)
+
+
+
+def _field_dtype(definition):
+    # dtype and missing value of the typed array of the field
+    _, dtype, missing = _FIELD_TYPES.get(definition[1], _FIELD_TYPES['String'])
+    if definition[1] != 'Flag' and definition[0] not in ['1', 'A']:
+        return object, None
+    return dtype, missing
+
+
+
+def _genotype_code(gt):
+    # number of non-reference alleles in the genotype, or -1 if any allele is missing
+    alleles = re.split('[/|]', gt)
+    if '.' in alleles or '' in alleles:
+        return -1
+    return sum(1 for a in alleles if a != '0')
+
+
+
+def _parse_genotypes(samples_buff, n_samples, gt_cache):
+    # decode GT of all samples from the sample columns (bytes) of a VCF record.
+    # the common diploid genotypes with single-digit alleles (e.g. `0/1`, `1|1`, `./.`)
+    # are decoded with vectorized operations, and the others are decoded one by one.
+    buff = np.frombuffer(samples_buff + b'\t\t\t\t', dtype=np.uint8)
+    sample_from = np.concatenate([[0], np.flatnonzero(buff[:len(samples_buff)] == 9) + 1])[:n_samples]
+    
+    a1 = buff[sample_from]
+    sep = buff[sample_from + 1]
+    a2 = buff[sample_from + 2]
+    end = buff[sample_from + 3]
+    
+    is_simple = (((sep == 47) | (sep == 124)) & ((end == 58) | (end == 9))
+                 & (((a1 >= 48) & (a1 <= 57)) | (a1 == 46)) & (((a2 >= 48) & (a2 <= 57)) | (a2 == 46)))
+    gt = np.where((a1 == 46) | (a2 == 46), -1, (a1 != 48).astype(np.int8) + (a2 != 48)).astype(np.int8)
+    
+    for i in np.flatnonzero(~is_simple):
+        _gt = samples_buff[sample_from[i]:].split(b'\t', 1)[0].split(b':', 1)[0].decode()
+        if _gt not in gt_cache:
+            gt_cache[_gt] = _genotype_code(_gt)
+        gt[i] = gt_cache[_gt]
+    
+    return gt
 
 
 
@@ -15,15 +130,23 @@ class VCF:
     
     
     
-    def parse_vcf(self, file_path, chr_name=None, pos_range=None):
+    def parse_vcf(self, file_path, chr_name=None, pos_range=None, info_fields=None, format_fields=None):
         '''
         Input: /path/to/vcf
         Output: dictionary containing SNPs information. The key is
                 a position on the reference, value is a list which
                 contains two elements of REF and ALT.
+        
+        If `format_fields` (e.g., `['DP']`) is given, `INFO` of the records
+        only contains the FORMAT keys, converted according to the `##FORMAT`
+        lines of the header. If `info_fields` (e.g., `['AF', 'DB']`) is given,
+        the values of the keys are extracted from the INFO column into
+        `INFO_FIELDS` of the records, converted according to the `##INFO` lines.
+        The other attributes are not split.
         '''
         
         snp_dict = {}
+        header = {'INFO': {}, 'FORMAT': {}}
         
         
         infh = None
@@ -36,9 +159,10 @@ class VCF:
         for file_buff in infh:
                 
             if file_buff[0] == '#':
+                _parse_header_line(file_buff, header)
                 continue
                 
-            vcf_record = file_buff.replace('\n', '').split('\t')
+            vcf_record = file_buff.replace('\n', '').split('\t', 10)
                 
             # discard if not target chromosome
             if chr_name is not None and chr_name != vcf_record[0]:
@@ -51,17 +175,7 @@ class VCF:
             if vcf_record[0] not in snp_dict:
                 snp_dict[vcf_record[0]] = []
             
-            vcf_tags = {}
-            for attr, val in zip(vcf_record[8].split(':'), vcf_record[9].split(':')):
-                vcf_tags[attr] = val
-                
-            snp_dict[vcf_record[0]].append({
-                'POS': int(vcf_record[1]),
-                'REF': vcf_record[3],
-                'ALT': vcf_record[4],
-                'QUAL': float(vcf_record[5]),
-                'INFO': vcf_tags
-            })
+            snp_dict[vcf_record[0]].append(self.__vcf_record(vcf_record, header, info_fields, format_fields))
         
         infh.close()
         
@@ -73,6 +187,509 @@ class VCF:
         return snp_dict
     
     
+    
+    def __vcf_record(self, vcf_record, header, info_fields, format_fields):
+        vcf_tags = {}
+        if format_fields is None:
+            for attr, val in zip(vcf_record[8].split(':'), vcf_record[9].split(':')):
+                vcf_tags[attr] = val
+        else:
+            attrs = vcf_record[8].split(':')
+            vals = vcf_record[9].split(':')
+            for attr in format_fields:
+                k = attrs.index(attr) if attr in attrs else len(vals)
+                vcf_tags[attr] = _convert_value(vals[k] if k < len(vals) else None,
+                                                header['FORMAT'].get(attr, ('1', 'String')))
+        
+        record = {
+            'POS': int(vcf_record[1]),
+            'REF': vcf_record[3],
+            'ALT': vcf_record[4],
+            'QUAL': float(vcf_record[5]),
+            'INFO': vcf_tags
+        }
+        
+        if info_fields is not None:
+            record['INFO_FIELDS'] = {}
+            for attr in info_fields:
+                record['INFO_FIELDS'][attr] = _convert_value(_info_value(vcf_record[7], attr),
+                                                             header['INFO'].get(attr, ('1', 'String')))
+        
+        return record
+    
+    
+    
+    def iter_vcf(self, file_path, chr_name=None, pos_range=None, batch_size=None, info_fields=None, format_fields=None):
+        '''Parse VCF file as an iterator.
+        
+        Records are yielded one by one (or as lists of `batch_size` records)
+        as soon as they are parsed. The VCF file should be sorted by
+        coordinates, since reading stops once it moves past the target
+        chromosome `chr_name` or the end of `pos_range` on it. If only
+        `pos_range` is given, the records beyond the range are skipped
+        without being parsed.
+        
+        Args:
+            file_path (str): A file path to VCF file.
+            chr_name (str): Yield only the variants on the chromosome.
+            pos_range (list): Yield only the variants in [start, end].
+            batch_size (int): If given, yield lists of records.
+            info_fields (list): INFO keys extracted, the same as `parse_vcf`.
+            format_fields (list): FORMAT keys extracted, the same as `parse_vcf`.
+        
+        Returns:
+            iterator: An iterator of dictionaries which contain the same items
+                      as the records of `parse_vcf` and the chromosome name `CHROM`.
+        '''
+        
+        infh = None
+        if os.path.splitext(file_path)[1] in ['.gz', '.gzip']:
+            infh = gzip.open(file_path, 'rt')
+        else:
+            infh = open(file_path, 'r')
+        
+        header = {'INFO': {}, 'FORMAT': {}}
+        is_target_chr = False
+        batch = []
+        
+        try:
+            for file_buff in infh:
+                
+                if file_buff[0] == '#':
+                    _parse_header_line(file_buff, header)
+                    continue
+                
+                # check chromosome and position before parsing the whole record
+                _chr_name, pos, _ = file_buff.split('\t', 2)
+                
+                if chr_name is not None:
+                    if chr_name != _chr_name:
+                        if is_target_chr:
+                            break
+                        continue
+                    is_target_chr = True
+                
+                if pos_range is not None:
+                    pos = int(pos)
+                    if pos < pos_range[0]:
+                        continue
+                    if pos_range[1] < pos:
+                        if chr_name is not None:
+                            break
+                        continue
+                
+                vcf_record = file_buff.replace('\n', '').split('\t', 10)
+                record = self.__vcf_record(vcf_record, header, info_fields, format_fields)
+                record['CHROM'] = _chr_name
+                
+                if batch_size is None:
+                    yield record
+                else:
+                    batch.append(record)
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+        finally:
+            infh.close()
+        
+        if len(batch) > 0:
+            yield batch
+    
+    
+    
+    def iter_vcf_genotypes(self, file_path, chr_name=None, pos_range=None, batch_size=10000):
+        '''Parse genotypes of all samples in VCF file as an iterator.
+        
+        Genotypes are yielded in batches of `batch_size` variants, coded as
+        the same as `parse_vcf_columns`. Reading stops once it moves past the
+        target chromosome or range, the same as `iter_vcf`.
+        
+        Args:
+            file_path (str): A file path to VCF file.
+            chr_name (str): Yield only the variants on the chromosome.
+            pos_range (list): Yield only the variants in [start, end].
+            batch_size (int): The number of variants in a batch.
+        
+        Returns:
+            iterator: An iterator of dictionaries which contain `samples`
+                      (sample names), `CHROM` and `POS` (arrays of variants),
+                      and `GT` (int8, variants x samples).
+        '''
+        
+        samples = []
+        gt_cache = {}
+        is_target_chr = False
+        batch_chr = []
+        batch_pos = []
+        batch_gt = []
+        
+        def __batch():
+            return {'samples': samples,
+                    'CHROM': np.array(batch_chr),
+                    'POS': np.array(batch_pos, dtype=np.int64),
+                    'GT': np.vstack(batch_gt).reshape(len(batch_gt), len(samples))}
+        
+        infh = None
+        if os.path.splitext(file_path)[1] in ['.gz', '.gzip']:
+            infh = gzip.open(file_path, 'rb')
+        else:
+            infh = open(file_path, 'rb')
+        
+        try:
+            for file_buff in infh:
+                
+                if file_buff[0:1] == b'#':
+                    if file_buff[0:6] == b'#CHROM':
+                        samples = file_buff.rstrip(b'\r\n').decode().split('\t')[9:]
+                    continue
+                
+                vcf_record = file_buff.rstrip(b'\r\n').split(b'\t', 9)
+                _chr_name = vcf_record[0].decode()
+                pos = int(vcf_record[1])
+                
+                if chr_name is not None:
+                    if chr_name != _chr_name:
+                        if is_target_chr:
+                            break
+                        continue
+                    is_target_chr = True
+                
+                if pos_range is not None:
+                    if pos < pos_range[0]:
+                        continue
+                    if pos_range[1] < pos:
+                        if chr_name is not None:
+                            break
+                        continue
+                
+                batch_chr.append(_chr_name)
+                batch_pos.append(pos)
+                if len(samples) > 0 and vcf_record[8].split(b':', 1)[0] == b'GT':
+                    batch_gt.append(_parse_genotypes(vcf_record[9], len(samples), gt_cache))
+                else:
+                    batch_gt.append(np.full(len(samples), -1, dtype=np.int8))
+                
+                if len(batch_pos) >= batch_size:
+                    yield __batch()
+                    batch_chr = []
+                    batch_pos = []
+                    batch_gt = []
+        finally:
+            infh.close()
+        
+        if len(batch_pos) > 0:
+            yield __batch()
+    
+    
+    
+    def parse_vcf_header(self, file_path):
+        '''Parse header of VCF file.
+        
+        Args:
+            file_path (str): A file path to VCF file.
+        
+        Returns:
+            dict: A dictionary contains `INFO` and `FORMAT` definitions
+                  (dictionaries whose keys are IDs and values are tuples of
+                  Number and Type), and `samples` (sample names).
+        '''
+        
+        header = {'INFO': {}, 'FORMAT': {}, 'samples': []}
+        
+        infh = None
+        if os.path.splitext(file_path)[1] in ['.gz', '.gzip']:
+            infh = gzip.open(file_path, 'rt')
+        else:
+            infh = open(file_path, 'r')
+        
+        for file_buff in infh:
+            if file_buff[0] != '#':
+                break
+            if file_buff.startswith('#CHROM'):
+                header['samples'] = file_buff.rstrip('\r\n').split('\t')[9:]
+            else:
+                _parse_header_line(file_buff, header)
+        
+        infh.close()
+        
+        return header
+    
+    
+    
+    def parse_vcf_columns(self, file_path, chr_name=None, pos_range=None, info_fields=None, format_fields=None,
+                          cache=False, cache_dirpath=None):
+        '''Parse VCF file into columnar arrays.
+        
+        All samples in the VCF file are loaded. Genotypes (GT) are coded as
+        the number of non-reference alleles (0, 1, 2, ...), and -1 for missing
+        genotypes.
+        
+        Args:
+            file_path (str): A file path to VCF file.
+            chr_name (str): Load only the variants on the chromosome.
+            pos_range (list): Load only the variants in [start, end].
+            info_fields (list): INFO keys (e.g., `['AF', 'DB']`) loaded as arrays.
+            format_fields (list): FORMAT keys (e.g., `['DP', 'GQ']`) loaded as
+                                  matrices (variants x samples).
+            cache (bool): If `True`, the arrays are cached as NumPy files, and
+                          loaded with memory-mapping at the next time.
+            cache_dirpath (str): A path to a directory to store the cache,
+                                 the directory of the VCF file by default.
+        
+        The fields are typed according to the `##INFO` and `##FORMAT` lines of
+        the header. Integer fields are loaded as int32 (-1 for missing), Float
+        as float32 (NaN for missing), Flag as bool, and String as object.
+        Fields with `Number=A` are loaded with the value of the first ALT
+        allele, and the other fields with multiple values are kept as text.
+        Only the requested fields are extracted, the other attributes in
+        INFO and FORMAT columns are not split.
+        
+        The cache is keyed on the path, size, and modification time of the VCF
+        file and the parse options, and the caches of the older versions of the
+        VCF file are removed when a new cache is written. Fields with String type
+        are cached as pickled object arrays, which are loaded without memory-mapping.
+        
+        Returns:
+            dict: A dictionary contains `samples` (sample names), `filters`
+                  and `alleles` (categories of FILTER and REF/ALT), and `variants`.
+                  `variants` is a dictionary whose keys are chromosome names and
+                  values are dictionaries of arrays, `POS` (int64), `QUAL` (float32,
+                  NaN for missing), `FILTER` (int16 codes), `REF` and `ALT` (int32 codes),
+                  `GT` (int8, variants x samples), the requested FORMAT fields, and
+                  `INFO` (a dictionary of the requested INFO fields).
+        '''
+        
+        options = [chr_name, pos_range, info_fields, format_fields]
+        if cache:
+            cache_path, cache_prefix = self.__cache_path(file_path, cache_dirpath, options)
+            if os.path.exists(cache_path):
+                return self.__load_columns_cache(cache_path)
+        
+        vcf_columns = self.__parse_vcf_columns(file_path, chr_name, pos_range, info_fields, format_fields)
+        
+        if cache:
+            self.__save_columns_cache(vcf_columns, file_path, cache_path, cache_prefix)
+        
+        return vcf_columns
+    
+    
+    
+    def __cache_path(self, file_path, cache_dirpath, options):
+        # cache directory is named as `<file name>.<file fingerprint>.<options>.vcfcache`
+        file_stat = os.stat(file_path)
+        fingerprint = hashlib.sha1(repr([os.path.abspath(file_path), file_stat.st_size,
+                                         file_stat.st_mtime_ns]).encode()).hexdigest()[:16]
+        options_hash = hashlib.sha1(repr(options).encode()).hexdigest()[:16]
+        
+        if cache_dirpath is None:
+            cache_dirpath = os.path.dirname(os.path.abspath(file_path))
+        cache_prefix = os.path.join(cache_dirpath, os.path.basename(file_path) + '.')
+        
+        return cache_prefix + fingerprint + '.' + options_hash + '.vcfcache', cache_prefix
+    
+    
+    
+    def __save_columns_cache(self, vcf_columns, file_path, cache_path, cache_prefix):
+        
+        # remove caches of the older versions of the file, that is, caches whose
+        # source is the same file but fingerprint is different. caches of the other
+        # files sharing the prefix (e.g. `x.vcf` and `x.vcf.gz`) are kept.
+        source = os.path.abspath(file_path)
+        fingerprint = cache_path[len(cache_prefix):].split('.')[0]
+        cache_dirpath = os.path.dirname(cache_prefix)
+        if os.path.exists(cache_dirpath):
+            for f in os.listdir(cache_dirpath):
+                _f = os.path.join(cache_dirpath, f)
+                _name = _f[len(cache_prefix):].split('.')
+                if not _f.startswith(cache_prefix) or len(_name) != 3 or _name[2] != 'vcfcache' \
+                        or _name[0] == fingerprint:
+                    continue
+                try:
+                    with open(os.path.join(_f, 'meta.json'), 'r') as infh:
+                        _source = json.load(infh).get('source')
+                except (OSError, ValueError):
+                    continue
+                if _source == source:
+                    shutil.rmtree(_f, ignore_errors=True)
+        else:
+            os.makedirs(cache_dirpath)
+        
+        # write arrays into a temporary directory, then rename it
+        tmp_cache_path = cache_path + '.tmp' + str(os.getpid())
+        os.makedirs(tmp_cache_path)
+        
+        meta = {'source': source, 'samples': vcf_columns['samples'], 'filters': vcf_columns['filters'],
+                'alleles': vcf_columns['alleles'], 'variants': []}
+        for i, (_chr_name, arrays) in enumerate(vcf_columns['variants'].items()):
+            fields = []
+            for name, arr in list(arrays.items()) + [('INFO/' + k, v) for k, v in arrays['INFO'].items()]:
+                if name == 'INFO':
+                    continue
+                np.save(os.path.join(tmp_cache_path, str(i) + '.' + name.replace('/', '.') + '.npy'),
+                        arr, allow_pickle=(arr.dtype == object))
+                fields.append([name, arr.dtype == object])
+            meta['variants'].append([_chr_name, fields])
+        
+        with open(os.path.join(tmp_cache_path, 'meta.json'), 'w') as outfh:
+            json.dump(meta, outfh)
+        
+        try:
+            os.rename(tmp_cache_path, cache_path)
+        except OSError:
+            # the cache has been written by another process
+            shutil.rmtree(tmp_cache_path, ignore_errors=True)
+    
+    
+    
+    def __load_columns_cache(self, cache_path):
+        with open(os.path.join(cache_path, 'meta.json'), 'r') as infh:
+            meta = json.load(infh)
+        
+        variants = {}
+        for i, (_chr_name, fields) in enumerate(meta['variants']):
+            variants[_chr_name] = {'INFO': {}}
+            for name, is_object in fields:
+                npy_path = os.path.join(cache_path, str(i) + '.' + name.replace('/', '.') + '.npy')
+                if is_object:
+                    arr = np.load(npy_path, allow_pickle=True)
+                else:
+                    arr = np.load(npy_path, mmap_mode='r')
+                if name.startswith('INFO/'):
+                    variants[_chr_name]['INFO'][name[5:]] = arr
+                else:
+                    variants[_chr_name][name] = arr
+        
+        return {'samples': meta['samples'], 'filters': meta['filters'],
+                'alleles': meta['alleles'], 'variants': variants}
+    
+    
+    
+    def __parse_vcf_columns(self, file_path, chr_name, pos_range, info_fields, format_fields):
+        
+        if info_fields is None:
+            info_fields = []
+        if format_fields is None:
+            format_fields = []
+        
+        header = {'INFO': {}, 'FORMAT': {}}
+        samples = []
+        filters = {}
+        alleles = {}
+        gt_cache = {}
+        columns = {}
+        
+        infh = None
+        if os.path.splitext(file_path)[1] in ['.gz', '.gzip']:
+            infh = gzip.open(file_path, 'rb')
+        else:
+            infh = open(file_path, 'rb')
+        
+        for file_buff in infh:
+            
+            if file_buff[0:1] == b'#':
+                if file_buff[0:6] == b'#CHROM':
+                    samples = file_buff.rstrip(b'\r\n').decode().split('\t')[9:]
+                else:
+                    _parse_header_line(file_buff.decode(), header)
+                continue
+            
+            vcf_record = file_buff.rstrip(b'\r\n').split(b'\t', 9)
+            _chr_name = vcf_record[0].decode()
+            
+            # discard if not target chromosome
+            if chr_name is not None and chr_name != _chr_name:
+                continue
+            
+            # discard if not in the target ranges
+            pos = int(vcf_record[1])
+            if pos_range is not None and (pos < pos_range[0] or pos_range[1] < pos):
+                continue
+            
+            if _chr_name not in columns:
+                columns[_chr_name] = {'POS': [], 'QUAL': [], 'FILTER': [], 'REF': [], 'ALT': [], 'GT': []}
+                for field in format_fields:
+                    columns[_chr_name][field] = []
+                for field in info_fields:
+                    columns[_chr_name]['INFO/' + field] = []
+            _columns = columns[_chr_name]
+            
+            _filter = vcf_record[6].decode()
+            if _filter not in filters:
+                filters[_filter] = len(filters)
+            ref = vcf_record[3].decode()
+            if ref not in alleles:
+                alleles[ref] = len(alleles)
+            alt = vcf_record[4].decode()
+            if alt not in alleles:
+                alleles[alt] = len(alleles)
+            
+            _columns['POS'].append(pos)
+            _columns['QUAL'].append(float('nan') if vcf_record[5] == b'.' else float(vcf_record[5]))
+            _columns['FILTER'].append(filters[_filter])
+            _columns['REF'].append(alleles[ref])
+            _columns['ALT'].append(alleles[alt])
+            
+            # genotypes
+            fmt = vcf_record[8].decode().split(':') if len(vcf_record) > 8 else []
+            if len(samples) == 0:
+                _columns['GT'].append(np.zeros(0, dtype=np.int8))
+            elif len(fmt) > 0 and fmt[0] == 'GT':
+                _columns['GT'].append(_parse_genotypes(vcf_record[9], len(samples), gt_cache))
+            else:
+                _columns['GT'].append(np.full(len(samples), -1, dtype=np.int8))
+            
+            # INFO fields
+            for field in info_fields:
+                val = _info_value(vcf_record[7], field.encode())
+                if isinstance(val, bytes):
+                    val = val.decode()
+                _columns['INFO/' + field].append(_column_value(val, header['INFO'].get(field, ('1', 'String'))))
+            
+            # FORMAT fields
+            if len(format_fields) > 0:
+                # split sample columns only up to the last requested field
+                field_index = {field: fmt.index(field) for field in format_fields if field in fmt}
+                sample_records = []
+                if len(samples) > 0 and len(field_index) > 0:
+                    k_max = max(field_index.values())
+                    sample_records = [v.split(':', k_max + 1) for v in vcf_record[9].decode().split('\t')]
+                for field in format_fields:
+                    definition = header['FORMAT'].get(field, ('1', 'String'))
+                    dtype, missing = _field_dtype(definition)
+                    vals = np.full(len(samples), missing, dtype=dtype)
+                    if field in field_index:
+                        k = field_index[field]
+                        for i, sample_record in enumerate(sample_records):
+                            if k < len(sample_record):
+                                vals[i] = _column_value(sample_record[k], definition)
+                    _columns[field].append(vals)
+        
+        infh.close()
+        
+        
+        # convert lists into arrays, and sort variants by positions
+        variants = {}
+        for _chr_name, _columns in columns.items():
+            o = np.argsort(np.array(_columns['POS'], dtype=np.int64), kind='stable')
+            variants[_chr_name] = {
+                'POS': np.array(_columns['POS'], dtype=np.int64)[o],
+                'QUAL': np.array(_columns['QUAL'], dtype=np.float32)[o],
+                'FILTER': np.array(_columns['FILTER'], dtype=np.int16)[o],
+                'REF': np.array(_columns['REF'], dtype=np.int32)[o],
+                'ALT': np.array(_columns['ALT'], dtype=np.int32)[o],
+                'GT': np.vstack(_columns['GT'])[o].reshape(len(o), len(samples))
+            }
+            for field in format_fields:
+                variants[_chr_name][field] = np.vstack(_columns[field])[o].reshape(len(o), len(samples))
+            variants[_chr_name]['INFO'] = {}
+            for field in info_fields:
+                dtype, _ = _field_dtype(header['INFO'].get(field, ('1', 'String')))
+                variants[_chr_name]['INFO'][field] = np.array(_columns['INFO/' + field], dtype=dtype)[o]
+        
+        return {'samples': samples, 'filters': list(filters.keys()),
+                'alleles': list(alleles.keys()), 'variants': variants}
+    
+    
         
 
 
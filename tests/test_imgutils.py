@@ -0,0 +1,41 @@
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+import cv2
+import pytest
+from pandabox.imgUtils import imgUtils
+
+
+VOC_XML = '''<annotation>
+    <filename>image.png</filename>
+    <size><width>120</width><height>80</height><depth>3</depth></size>
+    <object>
+        <name>cat</name>
+        <bndbox><xmin>12</xmin><ymin>8</ymin><xmax>60</xmax><ymax>40</ymax></bndbox>
+    </object>
+</annotation>
+'''
+
+
+@pytest.mark.parametrize('fast', [False, True])
+def test_resize(tmp_path, fast):
+    input_dirpath = tmp_path / 'input'
+    output_dirpath = tmp_path / 'output'
+    input_dirpath.mkdir()
+    output_dirpath.mkdir()
+
+    img = np.random.RandomState(0).randint(1, 256, size=(80, 120, 3)).astype(np.uint8)
+    cv2.imwrite(str(input_dirpath / 'image.png'), img)
+    (input_dirpath / 'image.xml').write_text(VOC_XML)
+
+    imgUtils().resize(str(input_dirpath), size=(60, 60), output_dirpath=str(output_dirpath),
+                      output_prefix='resized', n_jobs=1, fast=fast)
+
+    resized_img = cv2.imread(str(output_dirpath / 'resized_image.png'))
+    assert resized_img.shape == (60, 60, 3)
+
+    # 120x80 is resized to 60x40 and padded by 10 pixels at the top and the bottom
+    root = ET.parse(str(output_dirpath / 'resized_image.xml')).getroot()
+    assert [int(root.find('size').find(tag).text) for tag in ['width', 'height']] == [60, 60]
+    bndbox = root.find('object').find('bndbox')
+    assert [int(bndbox.find(tag).text) for tag in ['xmin', 'ymin', 'xmax', 'ymax']] == [6, 14, 30, 30]